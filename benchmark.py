@@ -0,0 +1,429 @@
+"""Синтетический нагрузочный бенчмарк бота с локальной заглушкой Bot API.
+
+Наполняет отдельную базу событиями, участниками и пользователями, поднимает fake_bot_api.py
+в том же процессе и прогоняет через Application настоящие обработчики: список событий,
+карточку события, присоединение, шаги календаря и рассылку напоминаний. Для каждого сценария
+считает пропускную способность, задержки p50/p99, запросы к базе и вызовы Bot API на обновление
+и пиковый RSS. Результат сохраняется в JSON вместе с хэшем коммита, чтобы сравнивать прогоны.
+
+--profile all прогоняет бенчмарк для каждого профиля из database.STORAGE_PROFILES в отдельном
+процессе (настройки базы читаются при импорте) и собирает результаты под именами
+«профиль/сценарий». --inline-db выполняет функции работы с базой прямо в event loop, без пула
+потоков run_db, — так можно сравнить оба способа на одной версии кода.
+
+Примеры:
+    python benchmark.py --events 10000 --participants 500000 --users 50000
+    python benchmark.py --profile default --output default.json
+    python benchmark.py --profile all --inline-db --output inline.json
+    python benchmark.py --compare benchmark_results/before.json benchmark_results/after.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from fake_bot_api import FakeBotAPI, BOT_USER
+
+SCENARIOS = ("list_events", "event_details", "join_event", "handle_calendar", "mixed", "reminders")
+
+# Доли сценариев в смешанной нагрузке
+MIXED_WEIGHTS = {"list_events": 3, "event_details": 5, "join_event": 2}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="benchmark.db", help="файл базы; рабочая events.db не трогается")
+    parser.add_argument("--keep-db", action="store_true", help="не пересоздавать базу, если файл уже есть")
+    parser.add_argument(
+        "--profile", default=os.getenv("DB_PROFILE", "production"), help="профиль хранения или all — все по очереди"
+    )
+    parser.add_argument("--inline-db", action="store_true", help="выполнять запросы в event loop, без пула потоков")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--participants", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--updates", type=int, default=2000, help="обновлений на сценарий")
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных пользователей")
+    parser.add_argument("--reminder-events", type=int, default=200, help="событий с наступившими задачами")
+    parser.add_argument("--send-rate", type=float, default=1000, help="лимит рассылки, сообщений в секунду")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, секунды")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument("--log-level", default="WARNING", help="уровень логов бота, чтобы оценить их стоимость")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию benchmark_results/<время>-<коммит>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="сравнить два файла результатов")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def peak_rss_mb():
+    # В Linux ru_maxrss в КиБ
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(args, rng):
+    """Наполнить пустую базу: пользователи, будущие события с задачами и участники."""
+    from sqlalchemy import insert
+    from database import engine, moscow_now, User, Event, Participant, ScheduledJob, _event_jobs
+
+    now = moscow_now().replace(second=0, microsecond=0)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, args.users + 1)])
+
+        events, jobs = [], []
+        for event_id in range(1, args.events + 1):
+            event_time = now + timedelta(minutes=rng.randint(2 * 60, 60 * 24 * 60))
+            events.append({
+                "id": event_id, "name": f"Событие {event_id}", "time": event_time,
+                "creator_id": rng.randint(1, args.users),
+            })
+            jobs.extend(
+                {"event_id": job.event_id, "kind": job.kind, "due_at": job.due_at}
+                for job in _event_jobs(event_id, event_time, now)
+            )
+        connection.execute(insert(Event), events)
+        connection.execute(insert(ScheduledJob), jobs)
+
+        # Участники распределены по событиям неравномерно, но без повторов внутри события
+        per_event = args.participants / args.events
+        batch = []
+        for event_id in range(1, args.events + 1):
+            count = min(args.users, int(rng.expovariate(1 / per_event))) if per_event else 0
+            batch.extend({"event_id": event_id, "user_id": user_id} for user_id in rng.sample(range(1, args.users + 1), count))
+            if len(batch) >= 50000:
+                connection.execute(insert(Participant), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(Participant), batch)
+    print(f"База наполнена за {time.perf_counter() - started:.1f} с")
+
+
+class Client:
+    """Генератор обновлений от имени одного пользователя Telegram."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, user_id):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def _message(self, text, message_id=1, sender=None):
+        return {
+            "message_id": message_id, "date": int(time.time()), "chat": self.chat,
+            "from": sender or self.user, "text": text,
+        }
+
+    def callback(self, data):
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id), "from": self.user, "chat_instance": str(self.user["id"]),
+                "data": data, "message": self._message("Главное меню", sender=BOT_USER),
+            },
+        }
+
+    def text(self, text):
+        update_id = next(self._update_ids)
+        return {"update_id": update_id, "message": self._message(text, message_id=update_id)}
+
+
+class Bench:
+    def __init__(self, args, application, api, rng):
+        self.args = args
+        self.application = application
+        self.api = api
+        self.rng = rng
+        self.clients = [Client(user_id) for user_id in range(1, args.concurrency + 1)]
+        self.queries = 0
+
+        from sqlalchemy import event
+        from database import engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count(*_):
+            self.queries += 1
+
+    async def send(self, payload):
+        from telegram import Update
+
+        update = Update.de_json(payload, self.application.bot)
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+
+    async def drive(self, make_update, updates):
+        """Отправить updates обновлений от всех клиентов одновременно; вернуть задержки и общее время."""
+        latencies = []
+        counter = itertools.count()
+
+        async def run_client(client):
+            while next(counter) < updates:
+                payload = make_update(client)
+                started = time.perf_counter()
+                await self.send(payload)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client(client) for client in self.clients))
+        return latencies, time.perf_counter() - started
+
+    def random_event(self):
+        return self.rng.randint(1, self.args.events)
+
+    def list_events(self, client):
+        from callbacks import encode, LIST_EVENTS
+        return client.callback(encode(LIST_EVENTS))
+
+    def event_details(self, client):
+        from callbacks import encode, EVENT_DETAILS
+        return client.callback(encode(EVENT_DETAILS, self.random_event()))
+
+    def join_event(self, client):
+        from callbacks import encode, JOIN_EVENT
+        return client.callback(encode(JOIN_EVENT, self.random_event()))
+
+    def mixed(self, client):
+        scenario = self.rng.choices(list(MIXED_WEIGHTS), weights=list(MIXED_WEIGHTS.values()))[0]
+        return getattr(self, scenario)(client)
+
+    def calendar_step(self, client):
+        # Переходы между страницами месяцев и дней ближайшего года, как при выборе даты
+        from telegram_bot_calendar.base import CB_CALENDAR, GOTO, SELECT
+
+        day = datetime.now().date() + timedelta(days=self.rng.randint(0, 365))
+        action, step = self.rng.choice(((SELECT, "y"), (SELECT, "m"), (GOTO, "d"), (GOTO, "m")))
+        return client.callback(f"{CB_CALENDAR}_0_{action}_{step}_{day.year}_{day.month}_1")
+
+    async def prepare_calendar(self):
+        """Перевести всех клиентов в состояние выбора даты: кнопка создания события и название."""
+        from callbacks import encode, CREATE_EVENT
+
+        for client in self.clients:
+            await self.send(client.callback(encode(CREATE_EVENT)))
+            await self.send(client.text("Бенчмарк"))
+
+    async def run_scenario(self, name):
+        processor = self.application.update_processor
+        if name == "reminders":
+            return await self.run_reminders()
+        if name == "handle_calendar":
+            await self.prepare_calendar()
+            make_update = self.calendar_step
+        else:
+            make_update = getattr(self, name)
+
+        calls, queries, commits = sum(self.api.calls.values()), self.queries, processor.commits
+        latencies, elapsed = await self.drive(make_update, self.args.updates)
+        count = len(latencies)
+        quantiles = statistics.quantiles(latencies, n=100) if count > 1 else latencies * 99
+        return {
+            "updates": count,
+            "seconds": round(elapsed, 3),
+            "throughput": round(count / elapsed, 1),
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies) * 1000, 2),
+                "p50": round(quantiles[49] * 1000, 2),
+                "p99": round(quantiles[98] * 1000, 2),
+                "max": round(max(latencies) * 1000, 2),
+            },
+            "queries_per_update": round((self.queries - queries) / count, 2),
+            "commits_per_update": round((processor.commits - commits) / count, 2),
+            "api_calls_per_update": round((sum(self.api.calls.values()) - calls) / count, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+    async def run_reminders(self):
+        """Сделать задачи ближайших событий наступившими и замерить рассылку process_due_jobs."""
+        from sqlalchemy import text
+        from telegram.ext import CallbackContext
+        from database import engine, moscow_now
+        from scheduler import process_due_jobs
+
+        with engine.begin() as connection:
+            jobs = connection.execute(
+                text(
+                    "UPDATE scheduled_jobs SET due_at = :due WHERE event_id IN "
+                    "(SELECT id FROM events ORDER BY time, id LIMIT :limit)"
+                ),
+                {"due": moscow_now() - timedelta(minutes=1), "limit": self.args.reminder_events},
+            ).rowcount
+
+        sent, queries = self.api.calls["sendMessage"], self.queries
+        started = time.perf_counter()
+        await process_due_jobs(CallbackContext(self.application))
+        elapsed = time.perf_counter() - started
+        sent = self.api.calls["sendMessage"] - sent
+        return {
+            "jobs": jobs,
+            "messages": sent,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(sent / elapsed, 1) if elapsed else 0,
+            "queries": self.queries - queries,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+
+def inline_run_db(modules):
+    """Подменить run_db в модулях бота: функция выполняется сразу в event loop, без пула потоков.
+
+    Очередь писателей сохраняется: без неё две транзакции в одном потоке ждали бы друг друга
+    внутри busy_timeout и останавливали весь event loop.
+    """
+    import database
+
+    async def run_db(func, *args, **kwargs):
+        if getattr(func, "writes", False):
+            uow = database.current_uow()
+            if uow is None:
+                async with database._write_lock:
+                    return func(*args, **kwargs)
+            await uow._lock_writes()
+            return uow._write(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    for module in modules:
+        module.run_db = run_db
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    fresh = not os.path.exists(args.db)
+    api = FakeBotAPI(latency=args.api_latency).start()
+    os.environ["TELEGRAM_API_URL"] = api.url
+    os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+
+    # Модули бота читают настройки из окружения при импорте
+    import notifier
+    from migrations import migrate
+    from main import build_application
+
+    migrate()
+    if fresh:
+        seed(args, rng)
+    if args.inline_db:
+        import bot_context, database, handlers, persistence, scheduler
+        inline_run_db([bot_context, database, handlers, persistence, scheduler])
+    notifier.notifier = notifier.Notifier(rate=args.send_rate, burst=args.send_rate, per_chat_interval=0)
+
+    application = build_application()
+    await application.initialize()
+    bench = Bench(args, application, api, rng)
+    results = {}
+    try:
+        for name in args.scenarios.split(","):
+            results[name] = await bench.run_scenario(name)
+            print(f"{name}: {json.dumps(results[name], ensure_ascii=False)}")
+    finally:
+        await application.shutdown()
+        api.stop()
+    return results
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding="utf-8") as file:
+        before = json.load(file)
+    with open(after_path, encoding="utf-8") as file:
+        after = json.load(file)
+    print(f"{before['commit']} -> {after['commit']}")
+    for name, new in after["results"].items():
+        old = before["results"].get(name)
+        if not old:
+            continue
+        for metric in ("throughput", "messages_per_second", "queries_per_update", "peak_rss_mb"):
+            if metric in new and metric in old:
+                change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+                print(f"{name:16} {metric:22} {old[metric]:>10} -> {new[metric]:<10} ({change:+.1f}%)")
+        if "latency_ms" in new and "latency_ms" in old:
+            print(f"{name:16} {'p99, мс':22} {old['latency_ms']['p99']:>10} -> {new['latency_ms']['p99']}")
+
+
+def write_report(args, results):
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join("benchmark_results", f"{stamp}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+
+
+def _child_argv(args, **overrides):
+    """Аргументы командной строки для запуска бенчмарка с теми же настройками и заменёнными overrides."""
+    argv = []
+    for key, value in {**vars(args), **overrides}.items():
+        flag = "--" + key.replace("_", "-")
+        if value is None or value is False:
+            continue
+        argv.extend([flag] if value is True else [flag, str(value)])
+    return argv
+
+
+def run_all_profiles(args):
+    """Прогнать бенчмарк для каждого профиля хранения в отдельном процессе; вернуть общие результаты."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ.pop("DB_PROFILE", None)  # профиль передаётся процессам аргументом
+    from database import STORAGE_PROFILES
+
+    root, ext = os.path.splitext(args.db)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in STORAGE_PROFILES:
+            print(f"Профиль {profile}")
+            output = os.path.join(directory, f"{profile}.json")
+            # У каждого профиля своя база: режим журнала WAL сохраняется в файле
+            argv = _child_argv(args, profile=profile, db=f"{root}-{profile}{ext}", output=output)
+            subprocess.run([sys.executable, os.path.abspath(__file__), *argv], check=True)
+            with open(output, encoding="utf-8") as file:
+                for name, result in json.load(file)["results"].items():
+                    results[f"{profile}/{name}"] = result
+    return results
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.profile == "all":
+        write_report(args, run_all_profiles(args))
+        return
+
+    if not args.keep_db:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ["DB_PROFILE"] = args.profile
+    # Логи идут через тот же конвейер, что и в боте; запуск с --log-level DEBUG показывает их стоимость
+    from log_setup import setup_logging
+    setup_logging(args.log_level.upper())
+
+    write_report(args, asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Контекст обработчиков с кэшем запросов на время одного обновления."""
+from telegram.ext import CallbackContext, ContextTypes
+
+from database import run_db, get_participants_by_event, current_uow
+
+
+class BotContext(CallbackContext):
+    """CallbackContext, который создаётся на каждое обновление и помнит загруженные за него данные.
+
+    Если несколько обработчиков или несколько мест одного обработчика спрашивают участников
+    одних и тех же событий, база запрашивается один раз. Данные отражают состояние на момент
+    первого запроса, поэтому после изменения состава участников их нужно сбросить через
+    forget_participants.
+    """
+
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id=chat_id, user_id=user_id)
+        self._participants = {}
+
+    async def participants(self, event_ids):
+        """Участники событий {event_id: [{"id": ..., "username": ...}]} одним запросом на недостающие."""
+        event_ids = list(event_ids)
+        missing = {event_id for event_id in event_ids if event_id not in self._participants}
+        if missing:
+            loaded = await run_db(get_participants_by_event, missing)
+            for event_id in missing:
+                self._participants[event_id] = loaded.get(event_id, [])
+        return {event_id: self._participants[event_id] for event_id in event_ids}
+
+    @property
+    def db(self):
+        """UnitOfWork обрабатываемого обновления (None в задачах JobQueue): session, queries, commit()."""
+        return current_uow()
+
+    def forget_participants(self, *event_ids):
+        for event_id in event_ids:
+            self._participants.pop(event_id, None)
+
+
+CONTEXT_TYPES = ContextTypes(context=BotContext)
@@ -0,0 +1,84 @@
+"""Готовые клавиатуры календаря, общие для всех пользователей.
+
+DetailedTelegramCalendar заново строит клавиатуру на каждое нажатие. Клавиатура зависит
+только от шага, даты страницы (её год, месяц и день попадают в callback_data кнопок) и минимальной
+даты, поэтому её можно построить один раз и дальше отдавать из словаря. Минимальная дата —
+сегодняшний день по Москве, так что прошедшие дни недоступны, а кэш сбрасывается при смене дня.
+Дата страницы приходит из callback_data, то есть от клиента, поэтому кэш ограничен
+CALENDAR_CACHE_SIZE клавиатурами и вытесняет самые давно запрошенные.
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+
+from telegram_bot_calendar import DetailedTelegramCalendar
+from telegram_bot_calendar.base import CB_CALENDAR, GOTO, NOTHING, SELECT
+from telegram_bot_calendar.detailed import STEPS
+
+from database import MOSCOW_TZ
+
+CALENDAR_CACHE_SIZE = 256  # клавиатур; шагов года, месяцев и дней на ближайшие годы хватает с запасом
+
+_keyboards = OrderedDict()  # (step, дата страницы) -> клавиатура для min_date == _cache_day
+_cache_day = None
+
+
+def _today():
+    return datetime.now(MOSCOW_TZ).date()
+
+
+def get_keyboard(step, current_date, min_date):
+    """Клавиатура шага календаря из кэша; строится при первом обращении."""
+    global _cache_day
+    if _cache_day != min_date:
+        # Наступил новый день: вчерашние клавиатуры позволяют выбрать уже прошедшую дату
+        _keyboards.clear()
+        _cache_day = min_date
+
+    key = (step, current_date)
+    keyboard = _keyboards.get(key)
+    if keyboard is None:
+        calendar = DetailedTelegramCalendar(current_date=current_date, min_date=min_date)
+        calendar._build(step=step)
+        keyboard = _keyboards[key] = calendar._keyboard
+        if len(_keyboards) > CALENDAR_CACHE_SIZE:
+            _keyboards.popitem(last=False)
+    else:
+        _keyboards.move_to_end(key)
+    return keyboard
+
+
+def build_calendar():
+    """Первый шаг календаря. Возвращает (keyboard, step), как DetailedTelegramCalendar().build()."""
+    today = _today()
+    step = DetailedTelegramCalendar.first_step
+    return get_keyboard(step, today, today), step
+
+
+def process_calendar(call_data):
+    """Обработать нажатие в календаре. Возвращает (result, keyboard, step), как DetailedTelegramCalendar().process().
+
+    Raises:
+        ValueError: если callback_data не относится к календарю или повреждены.
+    """
+    params = call_data.split("_")
+    if len(params) < 3 or params[0] != CB_CALENDAR:
+        raise ValueError(f"Не данные календаря: {call_data}")
+
+    action = params[2]
+    if action == NOTHING:
+        return None, None, None
+    if len(params) < 7:
+        raise ValueError(f"Неполные данные календаря: {call_data}")
+
+    step = params[3]
+    current_date = date(int(params[4]), int(params[5]), int(params[6]))
+    today = _today()
+
+    if action == GOTO:
+        return None, get_keyboard(step, current_date, today), step
+    if action == SELECT:
+        if step in STEPS:
+            next_step = STEPS[step]
+            return None, get_keyboard(next_step, current_date, today), next_step
+        return current_date, None, step
+    raise ValueError(f"Неизвестное действие календаря: {call_data}")
@@ -0,0 +1,104 @@
+"""Быстрый ответ на нажатия кнопок.
+
+Пока бот не ответил на callback query, клиент Telegram показывает на кнопке индикатор загрузки,
+а пользователь нажимает ещё раз. ChatOrderedUpdateProcessor вызывает start() для каждого нажатия
+сразу при получении, а begin() — когда обработчик нажатия начинает работу: если он не ответил сам
+за CALLBACK_ACK_DEADLINE секунд с этого момента, отправляется пустой ответ. Нажатие, которое ждёт
+в очереди чата дольше CALLBACK_ACK_QUEUE_LIMIT секунд, получает пустой ответ ещё до начала
+обработки. После обработки finish() отвечает на нажатие, если этого ещё никто не сделал.
+
+Обработчики отвечают через answer_callback(query, text, show_alert) — он отменяет пустой ответ
+и показывает текст. Если пустой ответ уже ушёл, второй Telegram не примет: тогда текст
+с show_alert=True отправляется обычным сообщением, а всплывающая подсказка без него пропадает.
+"""
+import asyncio
+import logging
+import os
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_ACK_DEADLINE = float(os.getenv("CALLBACK_ACK_DEADLINE", "0.5"))  # секунды с начала обработки
+CALLBACK_ACK_QUEUE_LIMIT = float(os.getenv("CALLBACK_ACK_QUEUE_LIMIT", "5"))  # секунды в очереди чата
+
+
+class _Ack:
+    __slots__ = ("query", "answered", "timer")
+
+    def __init__(self, query):
+        self.query = query
+        self.answered = False
+        self.timer = None
+
+
+_pending = {}  # id callback query -> _Ack
+_tasks = set()  # ответы по таймауту, чтобы задачи не собрал сборщик мусора
+
+
+async def _answer(state, text=None, show_alert=False):
+    state.answered = True
+    try:
+        await state.query.answer(text, show_alert=show_alert)
+    except TelegramError as e:
+        logger.warning("Не удалось ответить на нажатие кнопки: %s", e)
+
+
+def _answer_on_deadline(state):
+    if not state.answered:
+        # Отмечаем сразу: до запуска задачи обработчик может успеть вызвать answer_callback
+        state.answered = True
+        task = asyncio.create_task(_answer(state))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+def _schedule(state, delay):
+    if state.timer is not None:
+        state.timer.cancel()
+    state.timer = asyncio.get_running_loop().call_later(delay, _answer_on_deadline, state)
+
+
+def start(query):
+    """Нажатие получено: ответить пустым ответом, если оно прождёт очереди CALLBACK_ACK_QUEUE_LIMIT."""
+    state = _pending[query.id] = _Ack(query)
+    _schedule(state, CALLBACK_ACK_QUEUE_LIMIT)
+
+
+def begin(query):
+    """Обработчик нажатия начал работу: у него есть CALLBACK_ACK_DEADLINE, чтобы ответить самому."""
+    state = _pending.get(query.id)
+    if state is not None and not state.answered:
+        _schedule(state, CALLBACK_ACK_DEADLINE)
+
+
+async def finish(query):
+    """Нажатие обработано: ответить на него, если ни обработчик, ни таймер этого не сделали."""
+    state = _pending.pop(query.id, None)
+    if state is not None:
+        state.timer.cancel()
+        if not state.answered:
+            await _answer(state)
+
+
+async def answer_duplicate(query):
+    """Ответить на повторное нажатие, которое не будет обрабатываться."""
+    await _answer(_Ack(query))
+
+
+async def answer_callback(query, text=None, show_alert=False):
+    """Ответить на нажатие с текстом (или всплывающим окном при show_alert=True)."""
+    state = _pending.get(query.id)
+    if state is None:
+        # Нажатие пришло не через ChatOrderedUpdateProcessor
+        await query.answer(text, show_alert=show_alert)
+        return
+    if not state.answered:
+        state.timer.cancel()
+        await _answer(state, text, show_alert)
+        return
+    if text and show_alert:
+        chat_id = query.message.chat_id if query.message else query.from_user.id
+        await query.get_bot().send_message(chat_id=chat_id, text=text)
+    elif text:
+        logger.debug("Ответ на нажатие уже отправлен по таймауту, подсказка пропущена: %s", text)
@@ -0,0 +1,137 @@
+"""Компактный формат callback_data для кнопок бота.
+
+Данные кнопки — версия формата, однобуквенный код команды и аргументы через точку:
+"1r.2s.1kqz" вместо "remove_participant_100_2000000000". Целые числа записываются в base36,
+дата и время — числом секунд от EPOCH. Telegram ограничивает callback_data 64 байтами.
+
+Кнопки старого формата или другой версии не находят маршрута, и бот отвечает, что кнопка устарела.
+"""
+from datetime import datetime, timedelta
+
+VERSION = "1"
+SEP = "."
+MAX_LENGTH = 64
+EPOCH = datetime(2000, 1, 1)
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Коды команд
+MAIN_MENU = "m"
+CREATE_EVENT = "c"
+LIST_EVENTS = "l"
+LIST_EVENTS_PAGE = "L"
+EVENT_DETAILS = "d"
+JOIN_EVENT = "j"
+LEAVE_EVENT = "q"
+MY_EVENTS = "e"
+MY_EVENTS_PAGE = "E"
+MY_EVENT = "D"
+DELETE_EVENT = "x"
+REMOVE_PARTICIPANT = "r"
+MY_CALENDAR = "k"
+ADD_DATE = "a"
+MANAGE_DATE = "t"
+DELETE_DATE = "T"
+
+# Направление перехода для кнопок страниц
+PAGE_PREV = 0
+PAGE_NEXT = 1
+
+# Типы аргументов каждой команды
+ARG_TYPES = {
+    MAIN_MENU: (),
+    CREATE_EVENT: (),
+    LIST_EVENTS: (),
+    LIST_EVENTS_PAGE: (int, datetime, int),  # направление, время и id крайнего события страницы
+    EVENT_DETAILS: (int,),
+    JOIN_EVENT: (int,),
+    LEAVE_EVENT: (int,),
+    MY_EVENTS: (),
+    MY_EVENTS_PAGE: (int, datetime, int),
+    MY_EVENT: (int,),
+    DELETE_EVENT: (int,),
+    REMOVE_PARTICIPANT: (int, int),  # id события, id участника
+    MY_CALENDAR: (),
+    ADD_DATE: (),
+    MANAGE_DATE: (datetime,),
+    DELETE_DATE: (datetime,),
+}
+
+
+def _encode_int(value):
+    if value < 0:
+        return "-" + _encode_int(-value)
+    digits = []
+    while True:
+        value, rest = divmod(value, 36)
+        digits.append(_DIGITS[rest])
+        if not value:
+            return "".join(reversed(digits))
+
+
+def _encode_arg(value):
+    if isinstance(value, datetime):
+        return _encode_int((value - EPOCH) // timedelta(seconds=1))
+    return _encode_int(value)
+
+
+def _decode_arg(kind, text):
+    if not text:
+        raise ValueError("Пустой аргумент callback_data.")
+    number = int(text, 36)
+    if kind is datetime:
+        try:
+            return EPOCH + timedelta(seconds=number)
+        except OverflowError:
+            raise ValueError(f"Дата вне допустимого диапазона: {text}") from None
+    return number
+
+
+def prefix(op):
+    """Начало callback_data команды с аргументами: всё, что идёт до первого аргумента."""
+    return VERSION + op + SEP
+
+
+def encode(op, *args):
+    """Собрать callback_data команды op.
+
+    Raises:
+        ValueError: если число аргументов не совпадает с ARG_TYPES или данные длиннее 64 байт.
+    """
+    if len(args) != len(ARG_TYPES[op]):
+        raise ValueError(f"Команда {op!r} ожидает {len(ARG_TYPES[op])} аргументов, получено {len(args)}.")
+    data = VERSION + op
+    if args:
+        data += SEP + SEP.join(_encode_arg(arg) for arg in args)
+    if len(data) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+    return data
+
+
+def decode_args(op, rest):
+    """Разобрать аргументы команды op из хвоста callback_data после prefix(op).
+
+    Raises:
+        ValueError: если аргументы повреждены или их число не совпадает с ARG_TYPES.
+    """
+    kinds = ARG_TYPES[op]
+    parts = rest.split(SEP)
+    if len(parts) != len(kinds):
+        raise ValueError(f"Команда {op!r} ожидает {len(kinds)} аргументов: {rest}")
+    return tuple(_decode_arg(kind, part) for kind, part in zip(kinds, parts))
+
+
+def decode(data):
+    """Разобрать callback_data целиком. Возвращает (op, args).
+
+    Raises:
+        ValueError: если данные другой версии, неизвестной команды или повреждены.
+    """
+    if len(data) < 2 or data[0] != VERSION or data[1] not in ARG_TYPES:
+        raise ValueError(f"Неизвестный формат callback_data: {data}")
+    op, rest = data[1], data[2:]
+    if not rest and not ARG_TYPES[op]:
+        return op, ()
+    if not rest.startswith(SEP):
+        raise ValueError(f"Неизвестный формат callback_data: {data}")
+    return op, decode_args(op, rest[1:])
@@ -1,14 +1,294 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy import (
+    create_engine, event, Column, Integer, String, ForeignKey, DateTime, Index, LargeBinary, tuple_, and_, select,
+    literal, exists, delete, func
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, aliased
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import asyncio
+import contextvars
+import functools
+import logging
+import os
 import pytz
-from scheduler import send_reminder, start_event
+from event_cache import event_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Профили хранения: набор PRAGMA, которые выставляются на каждое новое соединение.
+# "default" — стандартные настройки SQLite (rollback journal), "production" — WAL и кэши.
+STORAGE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",          # читатели не блокируются писателем
+        "synchronous": "NORMAL",        # в режиме WAL безопасно и намного быстрее FULL
+        "cache_size": -64000,           # отрицательное значение — размер в КиБ
+        "busy_timeout": 5000,           # мс ожидания блокировки вместо немедленной ошибки
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///events.db")
+DB_PROFILE = os.getenv("DB_PROFILE", "production")
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(DB_WORKERS + 2)))
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", "3600"))  # секунды
+
+# Прошедшие события перед удалением копируются в event_history, если EVENT_HISTORY=1
+EVENT_HISTORY = os.getenv("EVENT_HISTORY", "0") == "1"
+
+if DB_PROFILE not in STORAGE_PROFILES:
+    raise ValueError(f"Неизвестный профиль хранения DB_PROFILE={DB_PROFILE!r}, доступны: {', '.join(STORAGE_PROFILES)}")
+
+# Отдельные PRAGMA можно переопределить переменными окружения, например DB_CACHE_SIZE=-128000
+SQLITE_PRAGMAS = dict(STORAGE_PROFILES[DB_PROFILE])
+for _pragma in ("journal_mode", "synchronous", "cache_size", "busy_timeout", "mmap_size", "temp_store"):
+    _value = os.getenv(f"DB_{_pragma.upper()}")
+    if _value is not None:
+        SQLITE_PRAGMAS[_pragma] = _value
+
+
+def _engine_options(url):
+    """Размер пула задаётся только для базы в файле: у SQLite в памяти свой пул без этих параметров."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    ):
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_WORKERS}
+
 
 # Создаем базу данных
 Base = declarative_base()
-engine = create_engine('sqlite:///events.db')
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+@event.listens_for(engine, "connect")
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def optimize_db():
+    """Периодическое обслуживание: обновить статистику планировщика и перенести WAL в основной файл."""
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA optimize")
+        if str(SQLITE_PRAGMAS.get("journal_mode", "")).upper() == "WAL":
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+# Пул потоков для запросов к базе: синхронный SQLAlchemy не должен блокировать event loop
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+# SQLite допускает одного писателя. Пишущие функции (см. writes) ждут своей очереди здесь, в event loop,
+# а не в потоках пула: иначе потоки, ждущие блокировку, не дают выполниться commit её владельца.
+_write_lock = asyncio.Lock()
+
+
+def writes(func):
+    """Пометить функцию, которая пишет в базу: run_db выполняет такие функции по одной."""
+    func.writes = True
+    return func
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполнить синхронную функцию работы с базой в пуле потоков и дождаться результата.
+
+    Функция выполняется в копии текущего контекста, поэтому видит сессию обновления (см. unit_of_work).
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    if not getattr(func, "writes", False):
+        return await loop.run_in_executor(_db_executor, call)
+
+    uow = current_uow()
+    if uow is None:
+        async with _write_lock:
+            return await loop.run_in_executor(_db_executor, call)
+    # Обновление держит очередь писателей до своего commit
+    await uow._lock_writes()
+    call = functools.partial(contextvars.copy_context().run, uow._write, func, *args, **kwargs)
+    return await loop.run_in_executor(_db_executor, call)
+
+
+_current_uow = contextvars.ContextVar("current_uow", default=None)
+
+
+class UnitOfWork:
+    """Общая сессия базы на время обработки одного обновления.
+
+    Все функции этого модуля, вызванные при обработке обновления, работают в одной сессии
+    и одной транзакции с общим identity map; изменения фиксируются одним commit в конце
+    обновления. Первая запись занимает очередь писателей до commit, поэтому обработчик
+    фиксирует изменения раньше через await context.db.commit(), чтобы не держать её
+    во время запросов к Telegram. Если обработчик упал, обработчик ошибок вызывает fail(),
+    и незафиксированные изменения откатываются.
+    """
+
+    def __init__(self):
+        self.session = SessionLocal()
+        self.queries = 0
+        self.query_seconds = 0.0  # заполняется, только если включены метрики (metrics.py)
+        self.commits = 0
+        self.closed = False
+        self.failed = False
+        self._writing = False
+        self._dirty = False
+        self._invalidated = set()
+
+    async def _lock_writes(self):
+        if not self._writing:
+            await _write_lock.acquire()
+            self._writing = True
+
+    def _unlock_writes(self):
+        if self._writing:
+            self._writing = False
+            _write_lock.release()
+
+    def _commit(self):
+        if self.session.in_transaction():
+            self.session.commit()
+            if self._dirty:
+                self.commits += 1
+                self._dirty = False
+
+    def _release(self):
+        # Транзакция без изменений не нужна: соединение возвращается в пул до следующего запроса,
+        # иначе обновления, ждущие ответа Telegram, разбирают весь пул и потоки базы встают в ожидание.
+        # Загруженные объекты остаются в identity map, поэтому expire при этом commit не нужен.
+        if self.session.in_transaction():
+            self.session.expire_on_commit = False
+            try:
+                self.session.commit()
+            finally:
+                self.session.expire_on_commit = True
+
+    def _write(self, func, *args, **kwargs):
+        """Выполнить пишущую функцию в SAVEPOINT общей транзакции.
+
+        Если функция упала (например, на IntegrityError при flush), откатываются только её
+        изменения: обработчик может перехватить ошибку, и остальные записи обновления
+        зафиксируются как обычно.
+        """
+        connection = self.session.connection()
+        # pysqlite начинает транзакцию только перед DML. SAVEPOINT вне транзакции SQLite сам
+        # превращает в транзакцию, и RELEASE зафиксировал бы её, поэтому сначала явный BEGIN.
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+        with self.session.begin_nested():
+            result = func(*args, **kwargs)
+        if not self._dirty:
+            self._release()
+        return result
+
+    def _finish(self, commit):
+        try:
+            if commit:
+                self._commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+
+    def _flush_invalidated(self):
+        # Пока транзакция не зафиксирована, другие обновления могли закэшировать старые карточки
+        if self._invalidated:
+            event_cache.bump(*self._invalidated)
+            self._invalidated.clear()
+
+    def fail(self):
+        """Обработка обновления завершилась ошибкой: при выходе откатить изменения вместо commit."""
+        self.failed = True
+
+    async def commit(self):
+        """Зафиксировать изменения сейчас, не дожидаясь конца обновления."""
+        try:
+            await run_db(self._commit)
+        finally:
+            self._unlock_writes()
+        self._flush_invalidated()
+
+
+def current_uow():
+    """Сессия обрабатываемого обновления или None вне обработки обновления."""
+    uow = _current_uow.get()
+    return None if uow is None or uow.closed else uow
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """Открыть общую сессию для обработки обновления.
+
+    При выходе изменения фиксируются, а при исключении или после uow.fail() — откатываются.
+    Application.process_update сам перехватывает исключения обработчиков, поэтому об ошибке
+    сообщает обработчик ошибок (update_processor.handle_error).
+    """
+    uow = UnitOfWork()
+    token = _current_uow.set(uow)
+    commit = False
+    try:
+        yield uow
+        commit = True
+    finally:
+        uow.closed = True
+        _current_uow.reset(token)
+        try:
+            if uow.session.in_transaction():
+                await run_db(uow._finish, commit and not uow.failed)
+        except Exception:
+            logger.exception("Не удалось зафиксировать изменения обновления")
+        finally:
+            uow._unlock_writes()
+            uow._flush_invalidated()
+
+
+@contextmanager
+def session_scope():
+    """Сессия для функции работы с базой.
+
+    При обработке обновления это общая сессия UnitOfWork: изменения отправляются в базу (flush),
+    но фиксируются в конце обновления. В остальных случаях — отдельная сессия с commit при выходе.
+    """
+    uow = current_uow()
+    if uow is None:
+        with SessionLocal() as session:
+            yield session
+            session.commit()
+        return
+    yield uow.session
+    uow.session.flush()
+    if not uow._dirty and not uow.session.in_nested_transaction():
+        uow._release()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_query(connection, cursor, statement, parameters, context, executemany):
+    uow = _current_uow.get()
+    if uow is not None:
+        uow.queries += 1
+        if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+            uow._dirty = True
+
+
+def _invalidate_events(*event_ids):
+    """Сбросить кэш карточек событий; в обновлении сброс повторяется после commit."""
+    event_cache.bump(*event_ids)
+    uow = current_uow()
+    if uow is not None:
+        uow._invalidated.update(event_ids)
+
 # Определяем модели
 class User(Base):
     __tablename__ = "users"
@@ -23,6 +303,12 @@ class Event(Base):
     creator_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     creator = relationship("User", back_populates="created_events")
 
+    # Индексы для постраничного вывода по ключу (time, id)
+    __table_args__ = (
+        Index("ix_events_time_id", "time", "id"),
+        Index("ix_events_creator_time_id", "creator_id", "time", "id"),
+    )
+
 class Participant(Base):
     __tablename__ = "participants"
     id = Column(Integer, primary_key=True, index=True)
@@ -31,6 +317,8 @@ class Participant(Base):
     event = relationship("Event", back_populates="participants")
     user = relationship("User")
 
+    __table_args__ = (Index("ux_participants_event_user", "event_id", "user_id", unique=True),)
+
 class BlockedParticipant(Base):
     __tablename__ = "blocked_participants"
     id = Column(Integer, primary_key=True, index=True)
@@ -39,150 +327,455 @@ class BlockedParticipant(Base):
     event = relationship("Event")
     user = relationship("User")
 
+    __table_args__ = (Index("ux_blocked_participants_event_user", "event_id", "user_id", unique=True),)
+
 class UserDate(Base):
     __tablename__ = "user_dates"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    date = Column(DateTime, nullable=False, unique=True)
+    date = Column(DateTime, nullable=False)
     user = relationship("User")
 
+    # Дата уникальна в пределах календаря одного пользователя
+    __table_args__ = (Index("ux_user_dates_user_date", "user_id", "date", unique=True),)
+
+class ScheduledJob(Base):
+    """Отложенное уведомление о событии; переживает перезапуск бота."""
+    __tablename__ = "scheduled_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # JOB_REMINDER или JOB_START
+    due_at = Column(DateTime, nullable=False, index=True)
+
+class EventHistory(Base):
+    """Прошедшее событие в сжатом виде для статистики (см. EVENT_HISTORY)."""
+    __tablename__ = "event_history"
+    id = Column(Integer, primary_key=True)  # id удалённого события
+    name = Column(String, nullable=False)
+    time = Column(DateTime, nullable=False, index=True)
+    creator_id = Column(Integer, nullable=False)
+    participants = Column(Integer, nullable=False)  # число участников на момент удаления
+
+class PersistedData(Base):
+    """user_data, chat_data и bot_data приложения в виде pickle (см. persistence.py)."""
+    __tablename__ = "persisted_data"
+    kind = Column(String, primary_key=True)  # "user", "chat" или "bot"
+    key = Column(Integer, primary_key=True)  # id пользователя или чата, для bot_data — 0
+    data = Column(LargeBinary, nullable=False)
+
+class ConversationState(Base):
+    """Состояние ConversationHandler для ключа диалога (см. persistence.py)."""
+    __tablename__ = "conversation_states"
+    name = Column(String, primary_key=True)  # имя ConversationHandler
+    key = Column(String, primary_key=True)   # ключ диалога в JSON, например [chat_id, user_id]
+    state = Column(String, nullable=False)   # состояние в JSON
+
 # Связи
 User.created_events = relationship("Event", back_populates="creator")
 Event.participants = relationship("Participant", back_populates="event")
 
-def create_db():
-    Base.metadata.create_all(bind=engine)
+# Типы отложенных задач
+JOB_REMINDER = "reminder"
+JOB_START = "start"
+
+_OFFSET_UNITS = {"d": "days", "h": "hours", "m": "minutes"}
+
+
+def parse_offsets(text):
+    """Разобрать список сдвигов вида "1d,1h,10m" в timedelta по убыванию.
+
+    Raises:
+        ValueError: если сдвиг записан не как число с единицей d, h или m.
+    """
+    offsets = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part[-1] not in _OFFSET_UNITS or not part[:-1].isdigit():
+            raise ValueError(f"Некорректный сдвиг напоминания: {part!r}, ожидается например 1d, 1h или 10m")
+        offsets.add(timedelta(**{_OFFSET_UNITS[part[-1]]: int(part[:-1])}))
+    return sorted(offsets, reverse=True)
+
+
+# За сколько до начала события приходят напоминания, например REMINDER_OFFSETS=1d,1h,10m
+REMINDER_OFFSETS = parse_offsets(os.getenv("REMINDER_OFFSETS", "1h"))
+
+MOSCOW_TZ = pytz.timezone("Europe/Moscow")
+
+
+def moscow_now():
+    """Текущее московское время без tzinfo — в таком виде время хранится в базе."""
+    return datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+
+
+EVENTS_PAGE_SIZE = 10
+
+# Сколько наступивших задач планировщик забирает из базы за один запрос
+DUE_JOBS_BATCH = int(os.getenv("DUE_JOBS_BATCH", "500"))
+
+# Сколько прошедших событий удаляется одной транзакцией, чтобы не держать блокировку записи долго
+PURGE_CHUNK = int(os.getenv("PURGE_CHUNK", "500"))
+
+# Результаты попытки присоединиться к событию
+MEMBER_JOINED = "joined"
+MEMBER_ALREADY = "already"
+MEMBER_BLOCKED = "blocked"
+EVENT_MISSING = "missing"
+
+
+def create_db(bind=engine):
+    """Создать все таблицы и индексы по текущим моделям (для новой базы, см. migrations.py)."""
+    Base.metadata.create_all(bind=bind)
+
+
+def backfill_scheduled_jobs(session):
+    """Создать задачи для событий, сохранённых до появления таблицы scheduled_jobs."""
+    has_start_job = session.query(ScheduledJob.id).filter(
+        ScheduledJob.event_id == Event.id, ScheduledJob.kind == JOB_START
+    ).exists()
+    events = session.query(Event.id, Event.time).filter(~has_start_job).all()
+    now = moscow_now()
+    session.add_all(job for event_id, event_time in events for job in _event_jobs(event_id, event_time, now))
+    session.flush()
 
 
 # Функция для добавления пользователя в таблицу users, если его еще нет
+@writes
 def add_user_to_db(user_id, username):
-    with SessionLocal() as session:
+    with session_scope() as session:
         user = session.query(User).filter(User.id == user_id).first()
         if not user:
             user = User(id=user_id, username=username)
             session.add(user)
-            session.commit()
 
 # Сохранение события в базу данных
-def save_event(event_name, event_time, creator_id, application):
-    """Сохранить событие в базу данных и настроить напоминания."""
-    moscow_tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(moscow_tz)
-    event_time = event_time.astimezone(moscow_tz)  # Приводим время события к московскому времени
-    reminder_time = event_time - timedelta(hours=1)
+@writes
+def save_event(event_name, event_time, creator_id):
+    """Сохранить событие в базу данных и вернуть его ID."""
+    event_time = event_time.astimezone(MOSCOW_TZ).replace(tzinfo=None)  # Храним московское время
 
-    with SessionLocal() as session:
-        # Сохраняем событие
+    with session_scope() as session:
         event = Event(name=event_name, time=event_time, creator_id=creator_id)
         session.add(event)
-        session.commit()
-        event_id = event.id
-
-        # Логируем и добавляем напоминание
-        if reminder_time > now:
-            print(f"Регистрация напоминания на {reminder_time}")
-            application.job_queue.run_once(
-                send_reminder,
-                when=(reminder_time - now).total_seconds(),
-                data={"event_id": event_id, "event_name": event_name}
-            )
-        else:
-            print(f"Пропущено напоминание для '{event_name}', так как время прошло.")
-
-        # Логируем и добавляем задачу для начала события
-        if event_time > now:
-            print(f"Регистрация начала события на {event_time}")
-            application.job_queue.run_once(
-                start_event,
-                when=(event_time - now).total_seconds(),
-                data={"event_id": event_id, "event_name": event_name}
-            )
-        else:
-            print(f"Пропущено событие '{event_name}', так как время прошло.")
-
-        return event_id
+        session.flush()
+        session.add_all(_event_jobs(event.id, event_time, moscow_now()))
+        return event.id
 
 
+def _event_jobs(event_id, event_time, now):
+    """Задачи для события: напоминания по REMINDER_OFFSETS (если их время ещё не прошло) и начало."""
+    jobs = []
+    for offset in REMINDER_OFFSETS:
+        reminder_time = event_time - offset
+        if reminder_time > now:
+            jobs.append(ScheduledJob(event_id=event_id, kind=JOB_REMINDER, due_at=reminder_time))
+    jobs.append(ScheduledJob(event_id=event_id, kind=JOB_START, due_at=event_time))
+    return jobs
 
 
+@writes
+def take_due_jobs(now, limit=DUE_JOBS_BATCH):
+    """Забрать до limit задач со временем не позже now, по возрастанию времени, вместе с участниками.
 
-# Сохранение участника события
-def save_participant(event_id, user_id):
+    Одной транзакцией задачи удаляются, а события, для которых наступило начало, удаляются
+    вместе с участниками и блокировками. Уведомления отправляются уже после этого, поэтому
+    при падении бота посреди рассылки задача не выполнится повторно.
+    Возвращает список словарей job_id, kind, due_at, event_id, event_name, event_time, participants.
+    """
     with SessionLocal() as session:
-        participant = Participant(event_id=event_id, user_id=user_id)
-        session.add(participant)
+        rows = (
+            session.query(ScheduledJob.id, ScheduledJob.kind, ScheduledJob.due_at, Event.id, Event.name, Event.time)
+            .join(Event, Event.id == ScheduledJob.event_id)
+            .filter(ScheduledJob.due_at <= now)
+            .order_by(ScheduledJob.due_at, ScheduledJob.id)
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return []
+
+        participants = _query_participants_by_event(session, {row[3] for row in rows})
+        session.query(ScheduledJob).filter(
+            ScheduledJob.id.in_([row[0] for row in rows])
+        ).delete(synchronize_session=False)
+        started = [row[3] for row in rows if row[1] == JOB_START]
+        if started:
+            _delete_events(session, started, archive=True)
         session.commit()
 
+    if started:
+        event_cache.bump(*started)
+    return [
+        {
+            "job_id": job_id, "kind": kind, "due_at": due_at, "event_id": event_id, "event_name": event_name,
+            "event_time": event_time, "participants": participants.get(event_id, []),
+        }
+        for job_id, kind, due_at, event_id, event_name, event_time in rows
+    ]
 
 
-def is_user_participant(event_id, user_id):
-    """Проверить, является ли пользователь участником события."""
-    with SessionLocal() as session:
-        participant = session.query(Participant).filter_by(event_id=event_id, user_id=user_id).first()
-        return participant is not None
+@writes
+def drop_missed_reminders(now):
+    """Удалить напоминания событий, которые уже начались (например, пока бот был выключен).
 
-def remove_participant(event_id, user_id):
-    """Удалить участника из события."""
+    Возвращает количество удалённых напоминаний.
+    """
     with SessionLocal() as session:
-        participant = session.query(Participant).filter_by(event_id=event_id, user_id=user_id).first()
-        if participant:
-            session.delete(participant)
-            session.commit()
+        started = session.query(Event.id).filter(Event.time <= now)
+        deleted = session.query(ScheduledJob).filter(
+            ScheduledJob.kind == JOB_REMINDER, ScheduledJob.event_id.in_(started)
+        ).delete(synchronize_session=False)
+        session.commit()
+    return deleted
 
-def get_events():
-    """Получить список всех событий."""
-    with SessionLocal() as session:
-        events = session.query(Event).all()
-        return [(event.id, event.name, event.time) for event in events]
 
-def get_user_events(user_id):
-    """Получить события, созданные пользователем."""
-    with SessionLocal() as session:
-        events = session.query(Event).filter(Event.creator_id == user_id).all()
-        return [(event.id, event.name, event.time) for event in events]
+@writes
+def purge_expired_events(before, limit=PURGE_CHUNK):
+    """Удалить до limit событий, начавшихся раньше before, вместе с участниками, блокировками и задачами.
 
-def get_participants(event_id):
-    """Получить список участников события, исключая заблокированных."""
+    Обычно событие удаляется при наступлении его начала; здесь подчищаются события, чьи задачи
+    потерялись. При EVENT_HISTORY события сначала копируются в event_history.
+    Возвращает количество удалённых событий; вызывайте повторно, пока результат равен limit.
+    """
     with SessionLocal() as session:
-        participants = (
-            session.query(User.id, User.username)
-            .join(Participant, User.id == Participant.user_id)
-            .filter(Participant.event_id == event_id)
-            .filter(~session.query(BlockedParticipant).filter(
-                BlockedParticipant.event_id == event_id,
-                BlockedParticipant.user_id == User.id
-            ).exists())
+        expired = [
+            event_id for event_id, in
+            session.query(Event.id).filter(Event.time < before).order_by(Event.time, Event.id).limit(limit)
+        ]
+        if not expired:
+            return 0
+        _delete_events(session, expired, archive=True)
+        session.commit()
+    event_cache.bump(*expired)
+    return len(expired)
+
+
+# Сохранение участника события (повторное сохранение ничего не меняет)
+@writes
+def save_participant(event_id, user_id):
+    with session_scope() as session:
+        session.execute(
+            insert(Participant).values(event_id=event_id, user_id=user_id)
+            .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+        )
+    _invalidate_events(event_id)
+
+
+@writes
+def join_event_member(event_id, user_id):
+    """Присоединить пользователя к событию одной транзакцией.
+
+    Вставка выполняется только если событие существует и пользователь не заблокирован;
+    повторное нажатие не создаёт дубль. Возвращает MEMBER_JOINED, MEMBER_ALREADY,
+    MEMBER_BLOCKED или EVENT_MISSING.
+    """
+    is_blocked = exists().where(BlockedParticipant.event_id == event_id, BlockedParticipant.user_id == user_id)
+    event_exists = exists().where(Event.id == event_id)
+    with session_scope() as session:
+        inserted = session.execute(
+            insert(Participant)
+            .from_select(
+                ["event_id", "user_id"],
+                select(literal(event_id), literal(user_id)).where(event_exists, ~is_blocked)
+            )
+            .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+        ).rowcount
+        if inserted:
+            _invalidate_events(event_id)
+            return MEMBER_JOINED
+
+        # Ничего не вставлено — выясняем причину в той же транзакции
+        blocked, present = session.execute(select(is_blocked, event_exists)).one()
+        if not present:
+            return EVENT_MISSING
+        return MEMBER_BLOCKED if blocked else MEMBER_ALREADY
+
+
+@writes
+def leave_event_member(event_id, user_id):
+    """Удалить участника из события. Вернуть True, если он был участником."""
+    with session_scope() as session:
+        deleted = session.query(Participant).filter_by(event_id=event_id, user_id=user_id).delete()
+    if deleted:
+        _invalidate_events(event_id)
+    return bool(deleted)
+
+
+@writes
+def kick_event_member(event_id, user_id):
+    """Удалить участника и заблокировать его в событии одной транзакцией."""
+    with session_scope() as session:
+        session.query(Participant).filter_by(event_id=event_id, user_id=user_id).delete()
+        session.execute(
+            insert(BlockedParticipant).values(event_id=event_id, user_id=user_id)
+            .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+        )
+    _invalidate_events(event_id)
+
+def get_events_page(creator_id=None, after=None, before=None, limit=EVENTS_PAGE_SIZE):
+    """Получить страницу предстоящих событий, упорядоченных по (time, id).
+
+    after/before — ключ (time, id) последнего события предыдущей или первого события
+    следующей страницы. Возвращает (events, has_prev, has_next), где events — список
+    кортежей (id, name, time).
+    """
+    with session_scope() as session:
+        query = session.query(Event.id, Event.name, Event.time).filter(Event.time >= moscow_now())
+        if creator_id is not None:
+            query = query.filter(Event.creator_id == creator_id)
+
+        if before is not None:
+            query = query.filter(tuple_(Event.time, Event.id) < tuple_(*before))
+            query = query.order_by(Event.time.desc(), Event.id.desc())
+        else:
+            if after is not None:
+                query = query.filter(tuple_(Event.time, Event.id) > tuple_(*after))
+            query = query.order_by(Event.time, Event.id)
+
+        # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+        events = [tuple(row) for row in query.limit(limit + 1)]
+
+    has_more = len(events) > limit
+    events = events[:limit]
+    if before is not None:
+        events.reverse()
+        return events, has_more, True
+    return events, after is not None, has_more
+
+def get_event(event_id):
+    """Получить событие в виде словаря или None, если его нет."""
+    with session_scope() as session:
+        event = session.query(Event).filter(Event.id == event_id).first()
+        if not event:
+            return None
+        return {"id": event.id, "name": event.name, "time": event.time, "creator_id": event.creator_id}
+
+def get_event_details(event_id):
+    """Получить карточку события: событие, имя организатора и видимых участников.
+
+    Результат кэшируется в памяти и сбрасывается при изменении состава участников
+    или удалении события. Возвращаемый словарь нельзя изменять.
+    """
+    return event_cache.get(event_id, _load_event_details)
+
+def _load_event_details(event_id):
+    """Загрузить карточку события одним запросом с JOIN по организатору и участникам."""
+    creator = aliased(User)
+    member = aliased(User)
+    with session_scope() as session:
+        # Заблокированные исключаются в условии JOIN, а не в WHERE: иначе событие, у которого
+        # остались только строки заблокированных участников, пропало бы из результата целиком
+        blocked = session.query(BlockedParticipant).filter(
+            BlockedParticipant.event_id == Participant.event_id,
+            BlockedParticipant.user_id == Participant.user_id
+        ).exists()
+        rows = (
+            session.query(Event.id, Event.name, Event.time, creator.username, member.id, member.username)
+            .outerjoin(creator, creator.id == Event.creator_id)
+            .outerjoin(Participant, and_(Participant.event_id == Event.id, ~blocked))
+            .outerjoin(member, member.id == Participant.user_id)
+            .filter(Event.id == event_id)
+            .order_by(Participant.id)
             .all()
         )
-    return [{"id": participant[0], "username": participant[1]} for participant in participants]
+    if not rows:
+        return None
+    event_id, name, time, creator_name = rows[0][:4]
+    return {
+        "id": event_id,
+        "name": name,
+        "time": time,
+        "creator": creator_name,
+        "participants": [
+            {"id": user_id, "username": username} for *_, user_id, username in rows if user_id is not None
+        ],
+    }
+
+@writes
+def delete_event_data(event_id):
+    """Удалить событие вместе с участниками и блокировками. Вернуть участников до удаления."""
+    with session_scope() as session:
+        participants = _query_participants_by_event(session, [event_id]).get(event_id, [])
+        _delete_events(session, [event_id])
+    _invalidate_events(event_id)
+    return participants
+
+def _delete_events(session, event_ids, archive=False):
+    """Удалить события и связанные строки. event_ids — список ID или подзапрос.
+
+    archive=True — прошедшие события: при EVENT_HISTORY они сначала копируются в event_history.
+    """
+    if archive and EVENT_HISTORY:
+        participants = (
+            select(func.count(Participant.id)).where(Participant.event_id == Event.id).scalar_subquery()
+        )
+        session.execute(
+            insert(EventHistory)
+            .from_select(
+                ["id", "name", "time", "creator_id", "participants"],
+                select(Event.id, Event.name, Event.time, Event.creator_id, participants)
+                .where(Event.id.in_(event_ids))
+            )
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+    for model in (ScheduledJob, Participant, BlockedParticipant):
+        session.query(model).filter(model.event_id.in_(event_ids)).delete(synchronize_session=False)
+    return session.query(Event).filter(Event.id.in_(event_ids)).delete(synchronize_session=False)
+
+def _query_participants_by_event(session, event_ids):
+    """Участники нескольких событий одним запросом: {event_id: [{"id": ..., "username": ...}]}."""
+    blocked = session.query(BlockedParticipant).filter(
+        BlockedParticipant.event_id == Participant.event_id,
+        BlockedParticipant.user_id == Participant.user_id
+    ).exists()
+    rows = (
+        session.query(Participant.event_id, User.id, User.username)
+        .join(User, User.id == Participant.user_id)
+        .filter(Participant.event_id.in_(event_ids), ~blocked)
+        .all()
+    )
+    participants = {}
+    for event_id, user_id, username in rows:
+        participants.setdefault(event_id, []).append({"id": user_id, "username": username})
+    return participants
+
+def get_participants_by_event(event_ids):
+    """Участники нескольких событий, исключая заблокированных, одним запросом: {event_id: [...]}.
+
+    События без участников в результат не попадают.
+    """
+    with session_scope() as session:
+        return _query_participants_by_event(session, event_ids)
 
-def block_participant(event_id, user_id):
-    """Добавить пользователя в список заблокированных для события."""
-    with SessionLocal() as session:
-        blocked = BlockedParticipant(event_id=event_id, user_id=user_id)
-        session.add(blocked)
-        session.commit()
+def get_participants(event_id):
+    """Получить список участников события, исключая заблокированных."""
+    return get_participants_by_event([event_id]).get(event_id, [])
 
+@writes
 def add_date(user_id, date):
     """Добавить дату для пользователя, если её ещё нет."""
-    with SessionLocal() as session:
+    if not isinstance(date, datetime):
+        # Календарь возвращает date; в базе и в условии ниже дата должна быть в одном виде
+        date = datetime(date.year, date.month, date.day)
+    with session_scope() as session:
         exists = session.query(UserDate).filter(UserDate.user_id == user_id, UserDate.date == date).first()
         if exists:
             return False  # Дата уже существует
         new_date = UserDate(user_id=user_id, date=date)
         session.add(new_date)
-        session.commit()
         return True
 
 def get_user_dates(user_id):
     """Получить список всех дат пользователя."""
-    with SessionLocal() as session:
-        dates = session.query(UserDate).filter(UserDate.user_id == user_id).all()
+    with session_scope() as session:
+        dates = session.query(UserDate).filter(UserDate.user_id == user_id).order_by(UserDate.date).all()
         return [date.date for date in dates]
 
+@writes
 def delete_user_date(user_id, date):
     """Удалить дату пользователя."""
-    with SessionLocal() as session:
+    with session_scope() as session:
         # Преобразуем дату в формат datetime, если она передана как строка
         if isinstance(date, str):
             from datetime import datetime
@@ -191,11 +784,58 @@ def delete_user_date(user_id, date):
         user_date = session.query(UserDate).filter(UserDate.user_id == user_id, UserDate.date == date).first()
         if user_date:
             session.delete(user_date)
-            session.commit()
-            print(f"Дата {date} для пользователя {user_id} успешно удалена.")
+            logger.debug("Дата %s пользователя %s удалена", date, user_id)
             return True
-        print(f"Дата {date} для пользователя {user_id} не найдена.")
+        logger.debug("Дата %s пользователя %s не найдена", date, user_id)
         return False
 
 
+def load_persisted_data(kind):
+    """Все сохранённые данные вида kind: {key: pickle}."""
+    with SessionLocal() as session:
+        return dict(session.execute(
+            select(PersistedData.key, PersistedData.data).where(PersistedData.kind == kind)
+        ).all())
+
+
+def load_conversation_states(name):
+    """Сохранённые состояния диалогов ConversationHandler name: {ключ JSON: состояние JSON}."""
+    with SessionLocal() as session:
+        return dict(session.execute(
+            select(ConversationState.key, ConversationState.state).where(ConversationState.name == name)
+        ).all())
+
+
+@writes
+def save_persistence_batch(data, conversations):
+    """Записать изменения одной транзакцией.
+
+    data — {(kind, key): pickle или None}, conversations — {(name, ключ JSON): состояние JSON или None};
+    None означает удаление строки.
+    """
+    data_rows = [{"kind": kind, "key": key, "data": blob} for (kind, key), blob in data.items() if blob is not None]
+    data_dropped = [kind_key for kind_key, blob in data.items() if blob is None]
+    state_rows = [
+        {"name": name, "key": key, "state": state}
+        for (name, key), state in conversations.items() if state is not None
+    ]
+    states_dropped = [name_key for name_key, state in conversations.items() if state is None]
 
+    with SessionLocal() as session:
+        if data_rows:
+            statement = insert(PersistedData)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=["kind", "key"], set_={"data": statement.excluded.data}
+            ), data_rows)
+        if data_dropped:
+            session.execute(delete(PersistedData).where(tuple_(PersistedData.kind, PersistedData.key).in_(data_dropped)))
+        if state_rows:
+            statement = insert(ConversationState)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=["name", "key"], set_={"state": statement.excluded.state}
+            ), state_rows)
+        if states_dropped:
+            session.execute(delete(ConversationState).where(
+                tuple_(ConversationState.name, ConversationState.key).in_(states_dropped)
+            ))
+        session.commit()
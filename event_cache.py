@@ -0,0 +1,60 @@
+"""Кэш карточек событий в памяти процесса с версиями для инвалидации."""
+import threading
+from collections import OrderedDict
+
+EVENT_CACHE_SIZE = 1024
+
+
+class VersionedCache:
+    """LRU-кэш, где у каждого ключа есть счётчик версий.
+
+    Значение сохраняется, только если версия не изменилась за время загрузки,
+    поэтому конкурирующая запись не оставит в кэше устаревшие данные.
+    """
+
+    def __init__(self, max_size=EVENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+
+    def _version(self, key):
+        return self._generation, self._versions.get(key, 0)
+
+    def get(self, key, loader):
+        """Вернуть значение из кэша или загрузить его через loader(key). None не кэшируется."""
+        with self._lock:
+            version = self._version(key)
+            cached = self._items.get(key)
+            if cached is not None and cached[0] == version:
+                self._items.move_to_end(key)
+                return cached[1]
+
+        value = loader(key)
+
+        if value is not None:
+            with self._lock:
+                if self._version(key) == version:
+                    self._items[key] = (version, value)
+                    self._items.move_to_end(key)
+                    while len(self._items) > self.max_size:
+                        self._items.popitem(last=False)
+        return value
+
+    def bump(self, *keys):
+        """Увеличить версию ключей после изменения данных."""
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._items.pop(key, None)
+
+    def clear(self):
+        """Сбросить весь кэш, например после массового удаления."""
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+            self._versions.clear()
+
+
+event_cache = VersionedCache()
@@ -2,36 +2,42 @@ import telegram
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
 from telegram.ext import ConversationHandler, CallbackContext
 from database import (
-    SessionLocal,
-    Event,
-    User,
-    Participant,
+    run_db,
     add_user_to_db,
     save_event,
     save_participant,
-    is_user_participant,
-    remove_participant,
-    get_participants,
-    block_participant,
-    BlockedParticipant,
+    join_event_member,
+    leave_event_member,
+    kick_event_member,
+    MEMBER_BLOCKED,
+    MEMBER_ALREADY,
+    EVENT_MISSING,
+    get_events_page,
+    get_event,
+    get_event_details,
+    delete_event_data,
     add_date,
     get_user_dates,
     delete_user_date
 )
+from notifier import notify_users
 
 from utils import main_menu_keyboard
+from render import edit_message
+from callback_ack import answer_callback
+import callbacks
 from datetime import datetime, time
-from telegram_bot_calendar import DetailedTelegramCalendar, LSTEP
+from telegram_bot_calendar import LSTEP
+from calendar_cache import build_calendar, process_calendar
 import pytz
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Обработчик для кнопки "Главное меню"
 async def main_menu(update: Update, context: CallbackContext):
     reply_markup = main_menu_keyboard()  # Используем клавиатуру из utils.py
-    await update.callback_query.message.edit_text('Выберите действие:', reply_markup=reply_markup)
+    await edit_message(update.callback_query.message, 'Выберите действие:', reply_markup=reply_markup)
 
 
 ASK_NAME = 1  # Состояние для запроса имени
@@ -43,7 +49,8 @@ async def start(update: Update, context: CallbackContext):
 
     if username:
         # Сохраняем и показываем главное меню
-        add_user_to_db(user_id, username)
+        await run_db(add_user_to_db, user_id, username)
+        await context.db.commit()  # фиксируем до запросов к Telegram, чтобы не держать блокировку записи
         reply_markup = main_menu_keyboard()
         await update.message.reply_text(
             "Добро пожаловать! Выберите действие из меню:",
@@ -63,8 +70,8 @@ async def start(update: Update, context: CallbackContext):
 # Обработчик создания события
 async def handle_create_event_button(update: Update, context: CallbackContext):
     """Начало процесса создания события."""
-    await update.callback_query.answer()
-    await update.callback_query.message.edit_text("Введите название события:")
+    await answer_callback(update.callback_query)
+    await edit_message(update.callback_query.message, "Введите название события:")
     return 1  # Переход к состоянию ввода названия события
 
 
@@ -77,9 +84,9 @@ async def event_name(update: Update, context: CallbackContext):
     context.user_data["event_name"] = event_name
 
     # Генерация календаря для выбора даты
-    calendar, step = DetailedTelegramCalendar().build()
+    calendar, step = build_calendar()
     await update.message.reply_text(
-        f"Выберите {step}:",
+        f"Выберите {LSTEP[step]}:",
         reply_markup=calendar
     )
     return 2  # Переход к выбору даты
@@ -89,9 +96,9 @@ async def event_name(update: Update, context: CallbackContext):
 
 # Обработчик ввода даты события
 async def event_date(update: Update, context: CallbackContext):
-    calendar, step = DetailedTelegramCalendar().build()
+    calendar, step = build_calendar()
     await update.message.reply_text(
-        f"Выберите {step}:",
+        f"Выберите {LSTEP[step]}:",
         reply_markup=calendar
     )
     return 3
@@ -107,7 +114,7 @@ async def handle_calendar(update: Update, context: CallbackContext):
             raise ValueError("Пустые данные для календаря.")
 
         # Обработка выбора даты
-        result, key, step = DetailedTelegramCalendar().process(query.data)
+        result, key, step = process_calendar(query.data)
 
         # Устанавливаем текущую дату в Московском часовом поясе
         moscow_tz = pytz.timezone("Europe/Moscow")
@@ -115,7 +122,8 @@ async def handle_calendar(update: Update, context: CallbackContext):
 
         if not result and key:
             # Показываем следующий шаг календаря
-            await query.message.edit_text(
+            await edit_message(
+                query.message,
                 f"Выберите {LSTEP[step]}:",
                 reply_markup=key
             )
@@ -127,8 +135,9 @@ async def handle_calendar(update: Update, context: CallbackContext):
             # Проверяем, что дата не в прошлом
             if selected_date < now:
                 # Генерируем календарь заново
-                calendar, step = DetailedTelegramCalendar().build()
-                await query.message.edit_text(
+                calendar, step = build_calendar()
+                await edit_message(
+                    query.message,
                     f"Нельзя выбрать дату в прошлом. Выберите {LSTEP[step]} ещё раз:",
                     reply_markup=calendar
                 )
@@ -136,14 +145,15 @@ async def handle_calendar(update: Update, context: CallbackContext):
 
             # Сохраняем выбранную дату и переходим к следующему шагу
             context.user_data['event_date'] = selected_date
-            await query.message.edit_text(
+            await edit_message(
+                query.message,
                 f"Вы выбрали дату: {selected_date}. Теперь введите время события (например, 14:30):"
             )
             return 3  # Переход к следующему шагу (ввод времени)
     except (KeyError, ValueError) as e:
-        print(f"Ошибка: {e}")
+        logger.warning("Некорректные данные календаря %r: %s", query.data, e)
         # Генерируем календарь заново при ошибке
-        calendar, step = DetailedTelegramCalendar().build()
+        calendar, step = build_calendar()
         await query.message.reply_text(
             "Произошла ошибка при обработке календаря. Попробуйте снова.",
             reply_markup=calendar
@@ -178,15 +188,16 @@ async def event_time(update: Update, context: CallbackContext):
         # Сохраняем событие в базу данных
         event_name = context.user_data['event_name']
         creator_id = update.message.from_user.id
-        event_id = save_event(
+        event_id = await run_db(
+            save_event,
             event_name=event_name,
             event_time=event_datetime,
-            creator_id=creator_id,
-            application=context.application  # Передача application
+            creator_id=creator_id
         )
 
         # Добавляем создателя как участника события
-        save_participant(event_id, creator_id)
+        await run_db(save_participant, event_id, creator_id)
+        await context.db.commit()  # событие, его задачи и организатор-участник — одной транзакцией
 
         # Подтверждение пользователю
         await update.message.reply_text(
@@ -204,54 +215,84 @@ async def event_time(update: Update, context: CallbackContext):
 
 
 
+def page_cursor_args(direction, cursor_time, event_id):
+    """Аргументы кнопки страницы (направление, время, id) -> (after, before) для get_events_page."""
+    cursor = (cursor_time, event_id)
+    return (cursor, None) if direction == callbacks.PAGE_NEXT else (None, cursor)
+
+
+def events_page_keyboard(events, participants, has_prev, has_next, page_op, item_op):
+    """Клавиатура страницы событий с числом участников и кнопками перехода на соседние страницы."""
+    buttons = [
+        [InlineKeyboardButton(
+            f"{name} ({len(participants[event_id])})", callback_data=callbacks.encode(item_op, event_id)
+        )]
+        for event_id, name, _ in events
+    ]
+
+    navigation = []
+    if has_prev:
+        first_id, _, first_time = events[0]
+        navigation.append(InlineKeyboardButton(
+            "« Предыдущие", callback_data=callbacks.encode(page_op, callbacks.PAGE_PREV, first_time, first_id)
+        ))
+    if has_next:
+        last_id, _, last_time = events[-1]
+        navigation.append(InlineKeyboardButton(
+            "Следующие »", callback_data=callbacks.encode(page_op, callbacks.PAGE_NEXT, last_time, last_id)
+        ))
+    if navigation:
+        buttons.append(navigation)
+
+    buttons.append([InlineKeyboardButton("Главное меню", callback_data=callbacks.encode(callbacks.MAIN_MENU))])
+    return InlineKeyboardMarkup(buttons)
+
+
+async def load_events_page(context, after=None, before=None, creator_id=None):
+    """Загрузить страницу событий по курсору (при пустой странице — первую) и участников всех её событий.
+
+    Возвращает (events, participants, has_prev, has_next); участники загружаются одним запросом.
+    """
+    events, has_prev, has_next = await run_db(get_events_page, creator_id=creator_id, after=after, before=before)
+    if not events and (after or before):
+        events, has_prev, has_next = await run_db(get_events_page, creator_id=creator_id)
+    participants = await context.participants(event_id for event_id, _, _ in events)
+    return events, participants, has_prev, has_next
+
+
 # Отображение списка событий
-async def list_events(update: Update, context: CallbackContext):
-    """Обработчик для отображения общего списка событий."""
+async def list_events(update: Update, context: CallbackContext, after=None, before=None):
+    """Обработчик для отображения общего списка предстоящих событий (постранично)."""
     query = update.callback_query
 
-    # Получаем список событий
-    with SessionLocal() as session:
-        events = session.query(Event).all()
+    # Получаем страницу событий
+    events, participants, has_prev, has_next = await load_events_page(context, after, before)
 
     if not events:
         # Отправляем уведомление, если событий нет
-        await query.answer("На данный момент нет доступных событий!", show_alert=True)
+        await answer_callback(query, "На данный момент нет доступных событий!", show_alert=True)
         return
 
-    # Создаём кнопки для каждого события
-    buttons = [
-        [InlineKeyboardButton(event.name, callback_data=f"event_details_{event.id}")]
-        for event in events
-    ]
-
-    buttons.append([InlineKeyboardButton("Главное меню", callback_data="main_menu")])
-
     # Отправляем список событий
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.message.edit_text("Доступные события:", reply_markup=reply_markup)
+    reply_markup = events_page_keyboard(
+        events, participants, has_prev, has_next, callbacks.LIST_EVENTS_PAGE, callbacks.EVENT_DETAILS
+    )
+    await edit_message(query.message, "Доступные события:", reply_markup=reply_markup)
 
 
 # Детали события и участники
-async def event_details(update: Update, context: CallbackContext):
+async def event_details(update: Update, context: CallbackContext, event_id):
     query = update.callback_query
 
     try:
-        # Ожидаем формат callback_data: event_details_<event_id>
-        data = query.data.split('_')
-        if len(data) != 3 or data[0] != "event" or data[1] != "details":
-            raise ValueError("Некорректный формат callback_data.")
-
-        event_id = int(data[2])
-
         # Получаем информацию о событии и участниках
-        with SessionLocal() as session:
-            event = session.query(Event).filter(Event.id == event_id).first()
-            if not event:
-                await query.answer("Событие не найдено.", show_alert=True)
-                return
+        event = await run_db(get_event_details, event_id)
+        if not event:
+            await answer_callback(query, "Событие не найдено.", show_alert=True)
+            return
 
-            participants = get_participants(event_id)
-            creator = session.query(User).filter(User.id == event.creator_id).first().username
+        participants = event["participants"]
+        creator = event["creator"]
 
         # Формируем список участников
         participant_list = "\n".join(
@@ -261,28 +302,28 @@ async def event_details(update: Update, context: CallbackContext):
 
         # Формируем сообщение
         message = (
-            f"Событие: {event.name}\n"
-            f"Дата: {event.time.strftime('%d-%m-%Y %H:%M')}\n"
+            f"Событие: {event['name']}\n"
+            f"Дата: {event['time'].strftime('%d-%m-%Y %H:%M')}\n"
             f"Организатор: {creator}\n\n"
             f"Участники:\n{participant_list}"
         )
 
         # Кнопки для управления
         keyboard = [
-            [InlineKeyboardButton("Присоединиться", callback_data=f"join_{event_id}")],
-            [InlineKeyboardButton("Покинуть", callback_data=f"leave_{event_id}")],
-            [InlineKeyboardButton("Главное меню", callback_data="main_menu")],
+            [InlineKeyboardButton("Присоединиться", callback_data=callbacks.encode(callbacks.JOIN_EVENT, event_id))],
+            [InlineKeyboardButton("Покинуть", callback_data=callbacks.encode(callbacks.LEAVE_EVENT, event_id))],
+            [InlineKeyboardButton("Главное меню", callback_data=callbacks.encode(callbacks.MAIN_MENU))],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.message.edit_text(message, reply_markup=reply_markup)
+        await edit_message(query.message, message, reply_markup=reply_markup)
 
     except ValueError as e:
-        print(f"Ошибка: {e}")
-        await query.answer("Произошла ошибка при обработке данных события.")
-    except Exception as e:
-        print(f"Непредвиденная ошибка: {e}")
-        await query.message.edit_text("Произошла ошибка. Попробуйте снова.")
+        logger.warning("Некорректные данные события: %s", e)
+        await answer_callback(query, "Произошла ошибка при обработке данных события.")
+    except Exception:
+        logger.exception("Ошибка при показе события")
+        await edit_message(query.message, "Произошла ошибка. Попробуйте снова.")
 
 
 
@@ -291,132 +332,120 @@ async def event_details(update: Update, context: CallbackContext):
 
 
 # Присоединение к событию
-async def join_event(update: Update, context: CallbackContext):
+async def join_event(update: Update, context: CallbackContext, event_id):
     """Обработчик для присоединения пользователя к событию."""
     query = update.callback_query
-    event_id = int(query.data.split('_')[1])
     user_id = query.from_user.id
 
-    with SessionLocal() as session:
-        # Проверяем, заблокирован ли пользователь
-        is_blocked = session.query(BlockedParticipant).filter_by(event_id=event_id, user_id=user_id).first()
-        if is_blocked:
-            await query.answer("Вы заблокированы и не можете присоединиться к этому событию.", show_alert=True)
-            return
+    # Добавляем пользователя как участника одной транзакцией
+    status = await run_db(join_event_member, event_id, user_id)
+    await context.db.commit()
+    context.forget_participants(event_id)
+
+    if status == EVENT_MISSING:
+        await answer_callback(query, "Событие не найдено.", show_alert=True)
+        return
+
+    if status == MEMBER_BLOCKED:
+        await answer_callback(query, "Вы заблокированы и не можете присоединиться к этому событию.", show_alert=True)
+        return
 
-    # Проверяем, не является ли пользователь уже участником
-    if is_user_participant(event_id, user_id):
-        await query.answer("Вы уже участвуете в этом событии!")
+    if status == MEMBER_ALREADY:
+        await answer_callback(query, "Вы уже участвуете в этом событии!")
         return
 
-    # Добавляем пользователя как участника
-    save_participant(event_id, user_id)
-    await query.answer("Вы успешно присоединились к событию!")
-    await event_details(update, context)
+    await answer_callback(query, "Вы успешно присоединились к событию!")
+    await event_details(update, context, event_id)
 
 
 
 
 # Покидание события
-async def leave_event(update: Update, context: CallbackContext):
-    event_id = int(update.callback_query.data.split('_')[1])
+async def leave_event(update: Update, context: CallbackContext, event_id):
     user_id = update.callback_query.from_user.id
 
-    if not is_user_participant(event_id, user_id):
-        await update.callback_query.answer('Вы не участвуете в этом событии!')
+    left = await run_db(leave_event_member, event_id, user_id)
+    await context.db.commit()
+    context.forget_participants(event_id)
+    if left:
+        await answer_callback(update.callback_query, 'Вы покинули событие!')
     else:
-        remove_participant(event_id, user_id)
-        await update.callback_query.answer('Вы покинули событие!')
+        await answer_callback(update.callback_query, 'Вы не участвуете в этом событии!')
 
-    await event_details(update, context)
+    await event_details(update, context, event_id)
 
 
 
-async def my_events(update: Update, context: CallbackContext):
-    """Обработчик для отображения списка событий пользователя."""
+async def my_events(update: Update, context: CallbackContext, after=None, before=None):
+    """Обработчик для отображения списка событий пользователя (постранично)."""
     query = update.callback_query
     user_id = query.from_user.id
 
-    # Получаем список событий пользователя
-    with SessionLocal() as session:
-        events = session.query(Event).filter(Event.creator_id == user_id).all()
+    # Получаем страницу событий пользователя
+    events, participants, has_prev, has_next = await load_events_page(context, after, before, creator_id=user_id)
 
     if not events:
         # Отправляем уведомление, если событий нет
-        await query.answer("У вас нет созданных событий!", show_alert=True)
+        await answer_callback(query, "У вас нет созданных событий!", show_alert=True)
         return
 
-    # Создаём кнопки для каждого события
-    buttons = [
-        [InlineKeyboardButton(event.name, callback_data=f"my_event_{event.id}")]
-        for event in events
-    ]
-
-    buttons.append([InlineKeyboardButton("Главное меню", callback_data="main_menu")])
-
     # Отправляем список событий
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.message.edit_text("Ваши события:", reply_markup=reply_markup)
+    reply_markup = events_page_keyboard(
+        events, participants, has_prev, has_next, callbacks.MY_EVENTS_PAGE, callbacks.MY_EVENT
+    )
+    await edit_message(query.message, "Ваши события:", reply_markup=reply_markup)
 
 
 
 
 
 # Обработчик для показа деталей события, созданного пользователем, с кнопкой "Удалить событие"
-async def my_event_details(update: Update, context: CallbackContext):
+async def my_event_details(update: Update, context: CallbackContext, event_id):
     """Обработчик для отображения деталей события."""
     query = update.callback_query
 
     try:
-        # Парсим ID события из query.data
-        data = query.data.split('_')
-        if len(data) != 3 or data[0] != "my" or data[1] != "event":
-            raise ValueError("Некорректный формат данных кнопки.")
-
-        event_id = int(data[2])
-
         # Получаем информацию о событии
-        with SessionLocal() as session:
-            event = session.query(Event).filter(Event.id == event_id).first()
-            if not event:
-                await query.message.edit_text("Событие не найдено.")
-                return
+        event = await run_db(get_event_details, event_id)
+        if not event:
+            await edit_message(query.message, "Событие не найдено.")
+            return
 
-            participants = get_participants(event_id)
+        participants = event["participants"]
 
         # Формируем список участников с кнопками удаления
         participant_buttons = [
             [
                 InlineKeyboardButton(
                     f"Удалить @{participant['username']}" if participant["username"] else f"Удалить ID {participant['id']}",
-                    callback_data=f"remove_participant_{event_id}_{participant['id']}"
+                    callback_data=callbacks.encode(callbacks.REMOVE_PARTICIPANT, event_id, participant['id'])
                 )
             ]
             for participant in participants
         ]
 
         # Добавляем кнопки для удаления события и возврата
-        participant_buttons.append([InlineKeyboardButton("Удалить событие", callback_data=f"delete_event_{event_id}")])
-        participant_buttons.append([InlineKeyboardButton("Назад", callback_data="my_events")])
+        participant_buttons.append([InlineKeyboardButton("Удалить событие", callback_data=callbacks.encode(callbacks.DELETE_EVENT, event_id))])
+        participant_buttons.append([InlineKeyboardButton("Назад", callback_data=callbacks.encode(callbacks.MY_EVENTS))])
 
         # Формируем текст сообщения
         message = (
-            f"Название: {event.name}\n"
-            f"Дата: {event.time.strftime('%d-%m-%Y %H:%M')}\n\n"
+            f"Название: {event['name']}\n"
+            f"Дата: {event['time'].strftime('%d-%m-%Y %H:%M')}\n\n"
             f"Участники:\n" +
             "\n".join(f"- @{p['username']}" if p['username'] else f"- Пользователь {p['id']}" for p in participants)
         )
 
         # Отправляем сообщение с кнопками
         reply_markup = InlineKeyboardMarkup(participant_buttons)
-        await query.message.edit_text(message, reply_markup=reply_markup)
+        await edit_message(query.message, message, reply_markup=reply_markup)
 
     except ValueError as e:
-        print(f"Ошибка: {e}")
-        await query.answer("Произошла ошибка при обработке данных события.")
-    except Exception as e:
-        print(f"Непредвиденная ошибка: {e}")
-        await query.message.edit_text("Произошла ошибка. Попробуйте снова.")
+        logger.warning("Некорректные данные события: %s", e)
+        await answer_callback(query, "Произошла ошибка при обработке данных события.")
+    except Exception:
+        logger.exception("Ошибка при показе события")
+        await edit_message(query.message, "Произошла ошибка. Попробуйте снова.")
 
 
 
@@ -427,54 +456,40 @@ async def my_event_details(update: Update, context: CallbackContext):
 
 
 # Удаление события с уведомлением участников, включая название события
-async def delete_event(update: Update, context: CallbackContext):
+async def delete_event(update: Update, context: CallbackContext, event_id):
     query = update.callback_query
-    event_id = int(query.data.split('_')[2])
-
-    with SessionLocal() as session:
-        # Получаем событие для имени
-        event = session.query(Event).filter(Event.id == event_id).first()
-        if not event:
-            await query.message.edit_text("Событие не найдено.")
-            return
 
-        event_name = event.name
-
-        # Удаляем участников
-        session.query(Participant).filter(Participant.event_id == event_id).delete()
-
-        # Удаляем записи о блокировке
-        session.query(BlockedParticipant).filter(BlockedParticipant.event_id == event_id).delete()
+    # Получаем событие для имени
+    event = await run_db(get_event, event_id)
+    if not event:
+        await edit_message(query.message, "Событие не найдено.")
+        return
 
-        # Удаляем само событие
-        session.delete(event)
-        session.commit()
+    event_name = event["name"]
 
-    # Уведомляем участников об удалении события
-    participants = get_participants(event_id)
-    for user in participants:
-        try:
-            await context.bot.send_message(
-                chat_id=user["id"],
-                text=f"Событие '{event_name}' было отменено организатором."
-            )
-        except telegram.error.BadRequest as e:
-            print(f"Ошибка отправки сообщения пользователю {user['id']}: {e}")
+    # Удаляем событие, участников и блокировки; участники возвращаются до удаления
+    participants = await run_db(delete_event_data, event_id)
+    await context.db.commit()
+    context.forget_participants(event_id)
 
     # Уведомляем создателя об успешном удалении
-    await query.message.edit_text("Событие успешно удалено.", reply_markup=main_menu_keyboard())
+    await edit_message(query.message, "Событие успешно удалено.", reply_markup=main_menu_keyboard())
+
+    # Уведомляем участников об удалении события в фоне: рассылка по большому списку занимает время
+    context.application.create_task(
+        notify_users(context.bot, participants, f"Событие '{event_name}' было отменено организатором."),
+        update=update
+    )
 
 
-async def remove_participant_handler(update: Update, context: CallbackContext):
+async def remove_participant_handler(update: Update, context: CallbackContext, event_id, user_id):
     """Обработчик для удаления участника события."""
     query = update.callback_query
-    data = query.data.split('_')
-    event_id = int(data[2])
-    user_id = int(data[3])
 
     # Удаляем участника из события и блокируем его
-    remove_participant(event_id, user_id)
-    block_participant(event_id, user_id)
+    await run_db(kick_event_member, event_id, user_id)
+    await context.db.commit()
+    context.forget_participants(event_id)
 
     # Уведомляем участника о том, что он удалён
     try:
@@ -483,43 +498,42 @@ async def remove_participant_handler(update: Update, context: CallbackContext):
             text=f"Вы были удалены из события. У вас больше нет возможности присоединиться."
         )
     except telegram.error.BadRequest as e:
-        print(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+        logger.warning("Не удалось отправить сообщение пользователю %s: %s", user_id, e)
 
     # Обновляем список участников
-    with SessionLocal() as session:
-        event = session.query(Event).filter(Event.id == event_id).first()
-        if not event:
-            await query.message.edit_text("Событие не найдено.")
-            return
+    event = await run_db(get_event_details, event_id)
+    if not event:
+        await edit_message(query.message, "Событие не найдено.")
+        return
 
-        participants = get_participants(event_id)
+    participants = event["participants"]
 
     # Формируем обновлённые кнопки участников
     participant_buttons = [
         [
             InlineKeyboardButton(
                 f"Удалить @{participant['username']}" if participant["username"] else f"Удалить ID {participant['id']}",
-                callback_data=f"remove_participant_{event_id}_{participant['id']}"
+                callback_data=callbacks.encode(callbacks.REMOVE_PARTICIPANT, event_id, participant['id'])
             )
         ]
         for participant in participants
     ]
 
     # Добавляем кнопки для удаления события и возврата
-    participant_buttons.append([InlineKeyboardButton("Удалить событие", callback_data=f"delete_event_{event_id}")])
-    participant_buttons.append([InlineKeyboardButton("Назад", callback_data="my_events")])
+    participant_buttons.append([InlineKeyboardButton("Удалить событие", callback_data=callbacks.encode(callbacks.DELETE_EVENT, event_id))])
+    participant_buttons.append([InlineKeyboardButton("Назад", callback_data=callbacks.encode(callbacks.MY_EVENTS))])
 
     # Формируем текст сообщения
     message = (
-        f"Название: {event.name}\n"
-        f"Дата: {event.time.strftime('%d-%m-%Y %H:%M')}\n\n"
+        f"Название: {event['name']}\n"
+        f"Дата: {event['time'].strftime('%d-%m-%Y %H:%M')}\n\n"
         f"Участники:\n" +
         "\n".join(f"- @{p['username']}" if p['username'] else f"- Пользователь {p['id']}" for p in participants)
     )
 
     # Обновляем сообщение с обновлёнными кнопками
     reply_markup = InlineKeyboardMarkup(participant_buttons)
-    await query.message.edit_text(message, reply_markup=reply_markup)
+    await edit_message(query.message, message, reply_markup=reply_markup)
 
 async def ask_name(update: Update, context: CallbackContext):
     """Обработчик для сохранения имени пользователя."""
@@ -527,7 +541,8 @@ async def ask_name(update: Update, context: CallbackContext):
     name = update.message.text.strip()
 
     # Сохраняем имя в базу данных
-    add_user_to_db(user_id, name)
+    await run_db(add_user_to_db, user_id, name)
+    await context.db.commit()
 
     # Показ главного меню
     reply_markup = main_menu_keyboard()  # Используем клавиатуру из utils.py
@@ -542,22 +557,21 @@ async def ask_name(update: Update, context: CallbackContext):
 async def my_calendar(update: Update, context: CallbackContext):
     """Главное меню календаря."""
     user_id = update.callback_query.from_user.id
-    dates = get_user_dates(user_id)
+    dates = await run_db(get_user_dates, user_id)
 
     # Формируем кнопки для дат
-    buttons = [[InlineKeyboardButton(date.strftime("%d-%m-%Y"), callback_data=f"manage_date_{date}")] for date in dates]
-    buttons.append([InlineKeyboardButton("Добавить дату", callback_data="add_date")])
-    buttons.append([InlineKeyboardButton("Назад", callback_data="main_menu")])
+    buttons = [[InlineKeyboardButton(date.strftime("%d-%m-%Y"), callback_data=callbacks.encode(callbacks.MANAGE_DATE, date))] for date in dates]
+    buttons.append([InlineKeyboardButton("Добавить дату", callback_data=callbacks.encode(callbacks.ADD_DATE))])
+    buttons.append([InlineKeyboardButton("Назад", callback_data=callbacks.encode(callbacks.MAIN_MENU))])
 
     reply_markup = InlineKeyboardMarkup(buttons)
-    await update.callback_query.message.edit_text("Ваш календарь:", reply_markup=reply_markup)
+    await edit_message(update.callback_query.message, "Ваш календарь:", reply_markup=reply_markup)
 
 async def add_date_handler(update: Update, context: CallbackContext):
     """Обработчик добавления даты."""
-    logger.info("Generating calendar for adding a date...")
-    calendar, step = DetailedTelegramCalendar().build()
-    logger.info(f"Calendar generated for step: {step}")
-    await update.callback_query.message.edit_text(
+    calendar, step = build_calendar()
+    await edit_message(
+        update.callback_query.message,
         f"Выберите {LSTEP[step]}:",
         reply_markup=calendar
     )
@@ -566,32 +580,16 @@ async def add_date_handler(update: Update, context: CallbackContext):
 async def handle_calendar_date(update: Update, context: CallbackContext):
     """Обработка выбора даты."""
     query = update.callback_query
-    logger.info(f"Callback data received: {query.data}")
 
     try:
-        # Проверяем, является ли callback данными для удаления даты
-        if query.data.startswith("delete_date_"):
-            logger.info("Data is for deleting a date.")
-            date = query.data.split("_", 2)[2]  # Получаем дату из delete_date_<date>
-            await delete_date(update, context, date)
-            return
-
-        # Проверяем, является ли callback данными для управления датой
-        if query.data.startswith("manage_date_"):
-            logger.info("Data is for managing a date.")
-            date = query.data.split("_", 2)[2]
-            await manage_date(update, context, date)
-            return
-
         # Обработка данных от календаря
-        logger.info("Processing calendar data...")
-        result, key, step = DetailedTelegramCalendar().process(query.data)
-        logger.info(f"Process result: {result}, Next step: {step}")
+        result, key, step = process_calendar(query.data)
+        logger.debug("Календарь %r: результат %s, следующий шаг %s", query.data, result, step)
 
         if not result and key:
             # Показываем следующий шаг выбора
-            logger.info(f"Generated keyboard for step '{step}': {key}")
-            await query.message.edit_text(
+            await edit_message(
+                query.message,
                 f"Выберите {LSTEP[step]}:",
                 reply_markup=key
             )
@@ -600,17 +598,17 @@ async def handle_calendar_date(update: Update, context: CallbackContext):
         if result:
             # Если дата выбрана, сохраняем её
             user_id = query.from_user.id
-            if add_date(user_id, result):
-                logger.info(f"Дата {result.strftime('%d-%m-%Y')} успешно добавлена!")
-                await query.message.edit_text(f"Дата {result.strftime('%d-%m-%Y')} успешно добавлена!")
+            added = await run_db(add_date, user_id, result)
+            await context.db.commit()
+            if added:
+                await edit_message(query.message, f"Дата {result.strftime('%d-%m-%Y')} успешно добавлена!")
             else:
-                logger.info(f"Дата {result.strftime('%d-%m-%Y')} уже существует!")
-                await query.message.edit_text(f"Дата {result.strftime('%d-%m-%Y')} уже существует.")
+                await edit_message(query.message, f"Дата {result.strftime('%d-%m-%Y')} уже существует.")
             await my_calendar(update, context)
-    except Exception as e:
+    except Exception:
         # Логируем ошибки
-        logger.error(f"Ошибка обработки календаря: {e}")
-        await query.message.edit_text("Произошла ошибка при выборе даты. Попробуйте снова.")
+        logger.exception("Ошибка обработки календаря %r", query.data)
+        await edit_message(query.message, "Произошла ошибка при выборе даты. Попробуйте снова.")
 
 
 
@@ -621,11 +619,11 @@ async def handle_calendar_date(update: Update, context: CallbackContext):
 async def manage_date(update: Update, context: CallbackContext, date):
     """Меню управления выбранной датой."""
     buttons = [
-        [InlineKeyboardButton("Удалить дату", callback_data=f"delete_date_{date}")],
-        [InlineKeyboardButton("Назад", callback_data="my_calendar")]
+        [InlineKeyboardButton("Удалить дату", callback_data=callbacks.encode(callbacks.DELETE_DATE, date))],
+        [InlineKeyboardButton("Назад", callback_data=callbacks.encode(callbacks.MY_CALENDAR))]
     ]
     reply_markup = InlineKeyboardMarkup(buttons)
-    await update.callback_query.message.edit_text(f"Управление датой {date}:", reply_markup=reply_markup)
+    await edit_message(update.callback_query.message, f"Управление датой {date}:", reply_markup=reply_markup)
 
 
 
@@ -636,16 +634,16 @@ async def delete_date(update: Update, context: CallbackContext, date):
 
     try:
         # Удаление даты из базы данных
-        logger.info(f"Attempting to delete date: {date}")
-        success = delete_user_date(user_id, date)
+        success = await run_db(delete_user_date, user_id, date)
+        await context.db.commit()
         if success:
-            await query.message.edit_text(f"Дата {date} удалена.")
+            await edit_message(query.message, f"Дата {date} удалена.")
         else:
-            await query.message.edit_text(f"Дата {date} не найдена или уже удалена.")
+            await edit_message(query.message, f"Дата {date} не найдена или уже удалена.")
         await my_calendar(update, context)
-    except Exception as e:
-        logger.error(f"Ошибка удаления даты: {e}")
-        await query.message.edit_text("Произошла ошибка при удалении даты. Попробуйте снова.")
+    except Exception:
+        logger.exception("Ошибка удаления даты %s", date)
+        await edit_message(query.message, "Произошла ошибка при удалении даты. Попробуйте снова.")
 
 
 
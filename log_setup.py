@@ -0,0 +1,142 @@
+"""Логирование бота через очередь: JSON-записи пишет фоновый поток.
+
+Логгеры только кладут LogRecord в очередь (QueueHandler). Подстановка аргументов в сообщение,
+сериализация в JSON и запись в stderr выполняются в потоке QueueListener, так что цикл событий
+не ждёт вывода. Аргументы передаются логгеру отдельно (logger.info("... %s", value)), а не
+f-строкой: тогда при выключенном уровне строка вообще не собирается.
+
+К записям, сделанным при обработке обновления, добавляются update_id, user_id и handler
+(см. bind_update), к записи об окончании обработки — duration. DEBUG-записи прореживаются:
+проходит доля LOG_DEBUG_SAMPLE, но не больше LOG_DEBUG_PER_SECOND в секунду. При переполнении
+очереди записи отбрасываются, а не блокируют обработчик.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1"))
+LOG_DEBUG_PER_SECOND = int(os.getenv("LOG_DEBUG_PER_SECOND", "100"))
+
+logger = logging.getLogger(__name__)
+
+_current_update = contextvars.ContextVar("log_update", default=None)
+
+
+def bind_update(update):
+    """Привязать записи лога текущего контекста к обновлению. Возвращает токен для unbind_update."""
+    return _current_update.set(update)
+
+
+def unbind_update(token):
+    _current_update.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON."""
+
+    FIELDS = ("update_id", "user_id", "handler", "duration")
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _DebugSampler(logging.Filter):
+    """Пропускает долю sample DEBUG-записей и не больше per_second в секунду; остальные уровни — все."""
+
+    def __init__(self, sample=LOG_DEBUG_SAMPLE, per_second=LOG_DEBUG_PER_SECOND):
+        super().__init__()
+        self.sample = sample
+        self.per_second = per_second
+        self._second = 0
+        self._count = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample < 1 and random.random() >= self.sample:
+            return False
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second, self._count = second, 0
+        self._count += 1
+        return self._count <= self.per_second
+
+
+class _UpdateContextFilter(logging.Filter):
+    """Добавляет к записи поля обновления, которое обрабатывается в текущем контексте."""
+
+    def filter(self, record):
+        update = _current_update.get()
+        if update is not None and not hasattr(record, "update_id"):
+            record.update_id = getattr(update, "update_id", None)
+            user = getattr(update, "effective_user", None)
+            record.user_id = user.id if user else None
+            record.handler = metrics.update_label(update)
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение собирается в потоке QueueListener; запись не покидает процесс, копировать её не нужно
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """Направить все логи процесса через очередь в фоновый поток, который пишет JSON в stream (stderr)."""
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    # Сначала прореживание: отброшенным записям не нужны поля обновления
+    handler.addFilter(_DebugSampler())
+    handler.addFilter(_UpdateContextFilter())
+    listener = logging.handlers.QueueListener(handler.queue, output)
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # httpx пишет каждый запрос к Bot API на уровне INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    listener.start()
+    atexit.register(_stop, listener, handler)
+    return listener
+
+
+def _stop(listener, handler):
+    if handler.dropped:
+        logger.warning("Записей лога отброшено из-за переполнения очереди: %d", handler.dropped)
+    listener.stop()
@@ -1,68 +1,153 @@
 import os
+import re
 from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
-from database import create_db
+from telegram_bot_calendar.base import CB_CALENDAR
+from migrations import migrate
+from database import DB_MAINTENANCE_INTERVAL
+from scheduler import (
+    sweep_stale_events, process_due_jobs, purge_expired_job, db_maintenance, SCHEDULER_INTERVAL, PURGE_INTERVAL
+)
+from persistence import SQLitePersistence
+from bot_context import CONTEXT_TYPES
+from notifier import MAX_CONCURRENCY
+import metrics
+from log_setup import setup_logging
+from update_processor import ChatOrderedUpdateProcessor, handle_error
+from router import CallbackRouter
+import callbacks
 from handlers import (
     start, handle_create_event_button, event_name, main_menu, list_events,
     my_events, event_details, my_event_details, join_event, leave_event,
     delete_event, handle_calendar, event_time, remove_participant_handler, ask_name,
-    my_calendar, add_date_handler, handle_calendar_date, manage_date, delete_date
+    my_calendar, add_date_handler, handle_calendar_date, manage_date, delete_date,
+    page_cursor_args
 )
 
 # Константы для состояний
 ASK_NAME = 1
+CALENDAR_PATTERN = f"^{CB_CALENDAR}_"
+CREATE_EVENT_PATTERN = f"^{re.escape(callbacks.encode(callbacks.CREATE_EVENT))}$"
 
 # Загрузка переменных окружения
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-def main():
-    # Создание базы данных, если её ещё нет
-    create_db()
+# Режим webhook включается, если задан WEBHOOK_URL; иначе бот работает через long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# Адрес Bot API, например локального telegram-bot-api или fake_bot_api.py для тестов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
+# Сколько обновлений обрабатывается одновременно; обновления одного чата всё равно идут по порядку
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+def build_router():
+    """Все кнопки вне диалогов обслуживает один CallbackQueryHandler с маршрутизацией по префиксу."""
+    router = CallbackRouter()
+    router.add_command(callbacks.MAIN_MENU, main_menu)
+    router.add_command(callbacks.CREATE_EVENT, handle_create_event_button)
+    router.add_command(callbacks.LIST_EVENTS, list_events)
+    router.add_command(callbacks.LIST_EVENTS_PAGE, list_events, page_cursor_args)
+    router.add_command(callbacks.MY_EVENTS, my_events)
+    router.add_command(callbacks.MY_EVENTS_PAGE, my_events, page_cursor_args)
+    router.add_command(callbacks.EVENT_DETAILS, event_details)
+    router.add_command(callbacks.MY_EVENT, my_event_details)
+    router.add_command(callbacks.JOIN_EVENT, join_event)
+    router.add_command(callbacks.LEAVE_EVENT, leave_event)
+    router.add_command(callbacks.DELETE_EVENT, delete_event)
+    router.add_command(callbacks.REMOVE_PARTICIPANT, remove_participant_handler)
+    router.add_command(callbacks.MY_CALENDAR, my_calendar)
+    router.add_command(callbacks.ADD_DATE, add_date_handler)
+    router.add_command(callbacks.MANAGE_DATE, manage_date)
+    router.add_command(callbacks.DELETE_DATE, delete_date)
+    router.add_fallback(lambda data: data.startswith(f"{CB_CALENDAR}_"), handle_calendar_date)
+    return router
+
+def build_application():
+    """Собрать приложение со всеми обработчиками и периодическими задачами (без запуска)."""
     # Инициализация приложения Telegram
-    application = Application.builder().token(BOT_TOKEN).build()
+    pool_size = MAX_CONCURRENCY + CONCURRENT_UPDATES + 4  # рассылки и обработчики параллельно
+    builder = Application.builder().token(BOT_TOKEN)
+    if metrics.ENABLED:
+        builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=pool_size))
+    else:
+        builder = builder.connection_pool_size(pool_size)
+    builder = (
+        builder
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(sweep_stale_events)
+        .context_types(CONTEXT_TYPES)  # кэш запросов на время обработки обновления
+        .persistence(SQLitePersistence())  # диалоги и user_data переживают перезапуск
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+    application = builder.build()
 
     user_registration_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_name)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="user_registration",
+        persistent=True,
     )
 
     create_event_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_create_event_button, pattern="create_event")],
+        entry_points=[CallbackQueryHandler(handle_create_event_button, pattern=CREATE_EVENT_PATTERN)],
         states={
             1: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_name)],
-            2: [CallbackQueryHandler(handle_calendar)],
+            2: [CallbackQueryHandler(handle_calendar, pattern=CALENDAR_PATTERN)],
             3: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_time)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="create_event",
+        persistent=True,
     )
 
+    # Напоминания и начало событий; при долгой рассылке следующий запуск пропускается, а не накладывается
+    application.job_queue.run_repeating(process_due_jobs, interval=SCHEDULER_INTERVAL, first=0)
+
+    # Подчистка прошедших событий, чьи задачи потерялись
+    application.job_queue.run_repeating(purge_expired_job, interval=PURGE_INTERVAL, first=PURGE_INTERVAL)
+
+    # Периодическое обслуживание базы
+    application.job_queue.run_repeating(db_maintenance, interval=DB_MAINTENANCE_INTERVAL, first=DB_MAINTENANCE_INTERVAL)
+
     # Регистрация обработчиков
     application.add_handler(user_registration_handler)
     application.add_handler(create_event_handler)
-    application.add_handler(CallbackQueryHandler(main_menu, pattern='main_menu'))
-    application.add_handler(CallbackQueryHandler(handle_create_event_button, pattern="create_event"))
-    application.add_handler(CallbackQueryHandler(list_events, pattern='list_events'))
-    application.add_handler(CallbackQueryHandler(my_events, pattern='my_events'))
-    application.add_handler(CallbackQueryHandler(event_details, pattern='event_details_'))
-    application.add_handler(CallbackQueryHandler(my_event_details, pattern="my_event_"))
-    application.add_handler(CallbackQueryHandler(join_event, pattern='join_'))
-    application.add_handler(CallbackQueryHandler(leave_event, pattern='leave_'))
-    application.add_handler(CallbackQueryHandler(delete_event, pattern='delete_event_'))
-    application.add_handler(CallbackQueryHandler(handle_calendar, pattern='^\\d{4}-\\d{2}-\\d{2}$'))
-    application.add_handler(CallbackQueryHandler(remove_participant_handler, pattern="remove_participant_"))
-    application.add_handler(CallbackQueryHandler(my_calendar, pattern='my_calendar'))
-    application.add_handler(CallbackQueryHandler(add_date_handler, pattern='add_date'))
-    application.add_handler(CallbackQueryHandler(handle_calendar_date, pattern=".*"))
-    application.add_handler(CallbackQueryHandler(manage_date, pattern='manage_date_'))
-    application.add_handler(CallbackQueryHandler(delete_date, pattern='delete_date_'))
+    application.add_handler(CallbackQueryHandler(build_router().dispatch))
+    application.add_error_handler(handle_error)
+    return application
+
+def main():
+    # JSON-логи пишет фоновый поток, обработчики только кладут записи в очередь
+    setup_logging()
+
+    # Создание базы данных или обновление её схемы до последней версии
+    migrate()
+    application = build_application()
+    if metrics.ENABLED:
+        metrics.add_gauges("bot_updates", application.update_processor.stats)
+        metrics.start_server()
 
     # Запуск бота
-    application.run_polling()
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == '__main__':
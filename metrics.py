@@ -0,0 +1,242 @@
+"""Метрики бота в текстовом формате Prometheus на локальном порту.
+
+Метрики включаются переменной METRICS_PORT (например, 9100). Без неё обработчики событий
+SQLAlchemy не регистрируются, Bot API вызывается обычным HTTPXRequest, а точки вызова
+проверяют ENABLED и ничего не измеряют.
+
+Собираются:
+    bot_update_seconds{handler}       время обработки обновления по команде кнопки или типу сообщения
+    bot_update_queries{handler}       SQL-запросов за обновление
+    bot_update_sql_seconds{handler}   суммарное время SQL-запросов за обновление
+    bot_sql_seconds                   время отдельных SQL-запросов (события engine из database.py)
+    bot_api_seconds{method}           запросы к Bot API по методам
+    bot_api_errors_total{method}      ответы Bot API с ошибкой и сетевые сбои
+    bot_job_lag_seconds{kind}         насколько позже своего времени взята задача планировщика
+    bot_updates_<ключ>                состояние очереди обновлений (ChatOrderedUpdateProcessor.stats)
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from telegram import Update
+from telegram.request import HTTPXRequest
+from telegram_bot_calendar.base import CB_CALENDAR
+
+import callbacks
+from database import engine, current_uow, moscow_now
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+ENABLED = METRICS_PORT > 0
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+_registry = []
+_gauges = []  # (префикс, функция, возвращающая словарь значений)
+
+
+def _labels(pairs):
+    pairs = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in pairs if name]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами и не более чем одной меткой. Безопасна для потоков базы."""
+
+    def __init__(self, name, description, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._counts = {}  # значение метки -> число наблюдений по корзинам, последняя — сверх границ
+        self._sums = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, label_value=""):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(label_value)
+            if counts is None:
+                counts = self._counts[label_value] = [0] * (len(self.buckets) + 1)
+                self._sums[label_value] = 0.0
+            counts[index] += 1
+            self._sums[label_value] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(label_value, list(counts), self._sums[label_value])
+                      for label_value, counts in sorted(self._counts.items())]
+        for label_value, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _labels([(self.label, label_value), ("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels([(self.label, label_value)])
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Счётчик с не более чем одной меткой."""
+
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label_value="", amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels([(self.label, label_value)])} {value}" for label_value, value in values)
+        return lines
+
+
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Время обработки обновления, секунды.", "handler")
+UPDATE_QUERIES = Histogram("bot_update_queries", "SQL-запросов за обновление.", "handler", QUERY_BUCKETS)
+UPDATE_SQL_SECONDS = Histogram("bot_update_sql_seconds", "Время SQL-запросов за обновление, секунды.", "handler")
+SQL_SECONDS = Histogram("bot_sql_seconds", "Время одного SQL-запроса, секунды.")
+API_SECONDS = Histogram("bot_api_seconds", "Время запроса к Bot API, секунды.", "method")
+API_ERRORS = Counter("bot_api_errors_total", "Запросы к Bot API с ошибкой.", "method")
+JOB_LAG = Histogram("bot_job_lag_seconds", "Задержка выполнения задачи планировщика, секунды.", "kind", LAG_BUCKETS)
+
+# Имя команды кнопки по её коду: "l" -> "list_events"
+_COMMAND_NAMES = {
+    value: name.lower() for name, value in vars(callbacks).items()
+    if name.isupper() and isinstance(value, str) and value in callbacks.ARG_TYPES
+}
+
+
+def update_label(update):
+    """Метка обработчика для обновления: команда кнопки, calendar, command или message.
+
+    Метка зависит только от кода команды, а не от аргументов, поэтому число рядов ограничено.
+    """
+    if not isinstance(update, Update):
+        return "other"
+    query = update.callback_query
+    if query is not None:
+        data = query.data or ""
+        if data.startswith(f"{CB_CALENDAR}_"):
+            return "calendar"
+        try:
+            return _COMMAND_NAMES[callbacks.decode(data)[0]]
+        except ValueError:
+            return "invalid_callback"
+    message = update.effective_message
+    if message is not None and message.text:
+        return "command" if message.text.startswith("/") else "message"
+    return "other"
+
+
+def observe_update(update, seconds, uow):
+    """Записать время обработки обновления и SQL-запросы его сессии."""
+    handler = update_label(update)
+    UPDATE_SECONDS.observe(seconds, handler)
+    if uow is not None:
+        UPDATE_QUERIES.observe(uow.queries, handler)
+        UPDATE_SQL_SECONDS.observe(uow.query_seconds, handler)
+
+
+def observe_job_lag(jobs):
+    """Записать задержку задач планировщика относительно их due_at."""
+    now = moscow_now()
+    for job in jobs:
+        JOB_LAG.observe(max((now - job["due_at"]).total_seconds(), 0.0), job["kind"])
+
+
+def add_gauges(prefix, collect):
+    """Показывать значения словаря collect() как gauges <prefix>_<ключ>."""
+    _gauges.append((prefix, collect))
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for prefix, collect in _gauges:
+        for key, value in collect().items():
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый запрос к Bot API и считает ошибки по методам."""
+
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(method)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method)
+        if code >= 400:
+            API_ERRORS.inc(method)
+        return code, payload
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info.pop("query_started", time.perf_counter())
+    SQL_SECONDS.observe(elapsed)
+    uow = current_uow()
+    if uow is not None:
+        uow.query_seconds += elapsed
+
+
+if ENABLED:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Отдавать /metrics из отдельного потока. Возвращает сервер (для shutdown)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,219 @@
+"""Версионные миграции схемы базы.
+
+Номер применённой миграции хранится в PRAGMA user_version. Новая база создаётся
+сразу по текущим моделям, существующая доводится до последней версии по шагам,
+каждый шаг — в отдельной транзакции.
+"""
+import logging
+import re
+import sys
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from database import engine, create_db, backfill_scheduled_jobs
+
+logger = logging.getLogger(__name__)
+
+
+def _add_scheduled_jobs(connection):
+    """Таблица отложенных задач и задачи для уже сохранённых событий."""
+    connection.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            kind VARCHAR NOT NULL,
+            due_at DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(event_id) REFERENCES events (id) ON DELETE CASCADE
+        )
+    """)
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_scheduled_jobs_id ON scheduled_jobs (id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_scheduled_jobs_event_id ON scheduled_jobs (event_id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_scheduled_jobs_due_at ON scheduled_jobs (due_at)")
+    backfill_scheduled_jobs(Session(bind=connection))
+
+
+def _add_hot_query_indexes(connection):
+    """Индексы для выборок участников, блокировок и списков событий."""
+    # Перед уникальными индексами убираем накопившиеся дубли (event_id, user_id)
+    for table in ("participants", "blocked_participants"):
+        connection.exec_driver_sql(
+            f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY event_id, user_id)"
+        )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_participants_event_user ON participants (event_id, user_id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_blocked_participants_event_user "
+        "ON blocked_participants (event_id, user_id)"
+    )
+    # Индекс (creator_id, time, id) заодно обслуживает выборки по creator_id, а (time, id) — по time
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_events_time_id ON events (time, id)")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_events_creator_time_id ON events (creator_id, time, id)"
+    )
+
+
+def _rebuild_user_dates(connection):
+    """Убрать глобальную уникальность user_dates.date: дата уникальна только для одного пользователя.
+
+    SQLite не умеет удалять ограничение UNIQUE, поэтому таблица пересоздаётся.
+    """
+    connection.exec_driver_sql("""
+        CREATE TABLE user_dates_new (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            date DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """)
+    connection.exec_driver_sql("""
+        INSERT INTO user_dates_new (id, user_id, date)
+        SELECT MIN(id), user_id, date FROM user_dates GROUP BY user_id, date
+    """)
+    connection.exec_driver_sql("DROP TABLE user_dates")
+    connection.exec_driver_sql("ALTER TABLE user_dates_new RENAME TO user_dates")
+    connection.exec_driver_sql("CREATE INDEX ix_user_dates_id ON user_dates (id)")
+    connection.exec_driver_sql("CREATE UNIQUE INDEX ux_user_dates_user_date ON user_dates (user_id, date)")
+
+
+def _add_persistence_tables(connection):
+    """Таблицы для SQLitePersistence: данные пользователей и чатов, состояния диалогов."""
+    connection.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS persisted_data (
+            kind VARCHAR NOT NULL,
+            "key" INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, "key")
+        )
+    """)
+    connection.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            name VARCHAR NOT NULL,
+            "key" VARCHAR NOT NULL,
+            state VARCHAR NOT NULL,
+            PRIMARY KEY (name, "key")
+        )
+    """)
+
+
+def _add_event_history(connection):
+    """Архив прошедших событий; заодно удалить строки, оставшиеся от давно удалённых событий."""
+    connection.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS event_history (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            time DATETIME NOT NULL,
+            creator_id INTEGER NOT NULL,
+            participants INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )
+    """)
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_event_history_time ON event_history (time)")
+    for table in ("participants", "blocked_participants", "scheduled_jobs"):
+        connection.exec_driver_sql(f"DELETE FROM {table} WHERE event_id NOT IN (SELECT id FROM events)")
+
+
+# (версия, описание, функция). Новые миграции добавляются только в конец.
+MIGRATIONS = [
+    (1, "таблица scheduled_jobs", _add_scheduled_jobs),
+    (2, "индексы горячих запросов", _add_hot_query_indexes),
+    (3, "уникальность user_dates по (user_id, date)", _rebuild_user_dates),
+    (4, "таблицы persistence", _add_persistence_tables),
+    (5, "архив событий event_history", _add_event_history),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(bind=engine):
+    """Создать новую базу или применить к существующей недостающие миграции."""
+    if not inspect(bind).get_table_names():
+        create_db(bind)
+        with bind.begin() as connection:
+            connection.exec_driver_sql(f"PRAGMA user_version = {LATEST_VERSION}")
+        logger.info("Создана новая база, версия схемы %d", LATEST_VERSION)
+        return
+
+    with bind.connect() as connection:
+        version = get_version(connection)
+        connection.rollback()
+        for target, description, apply in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("Миграция %d: %s", target, description)
+            # pysqlite сам не открывает транзакцию перед DDL, поэтому начинаем её явно
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                apply(connection)
+                connection.exec_driver_sql(f"PRAGMA user_version = {target}")
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+
+# Запросы, которые выполняются на каждое нажатие кнопки; ни один не должен сканировать таблицу целиком
+HOT_QUERIES = {
+    "участник события": "SELECT id FROM participants WHERE event_id = 1 AND user_id = 1",
+    "блокировка участника": "SELECT id FROM blocked_participants WHERE event_id = 1 AND user_id = 1",
+    "карточка события": """
+        SELECT events.id, users_1.username, users_2.id FROM events
+        LEFT OUTER JOIN users AS users_1 ON users_1.id = events.creator_id
+        LEFT OUTER JOIN participants ON participants.event_id = events.id AND NOT EXISTS (
+            SELECT 1 FROM blocked_participants WHERE blocked_participants.event_id = participants.event_id
+                AND blocked_participants.user_id = participants.user_id
+        )
+        LEFT OUTER JOIN users AS users_2 ON users_2.id = participants.user_id
+        WHERE events.id = 1
+    """,
+    "страница событий": """
+        SELECT id, name, time FROM events WHERE time >= '2000-01-01' AND (time, id) > ('2000-01-01', 1)
+        ORDER BY time, id LIMIT 11
+    """,
+    "страница событий организатора": """
+        SELECT id, name, time FROM events WHERE time >= '2000-01-01' AND creator_id = 1
+        ORDER BY time, id LIMIT 11
+    """,
+    "даты пользователя": "SELECT date FROM user_dates WHERE user_id = 1 ORDER BY date",
+    "дата пользователя": "SELECT id FROM user_dates WHERE user_id = 1 AND date = '2000-01-01'",
+    "задачи события": "SELECT id FROM scheduled_jobs WHERE event_id = 1",
+    "прошедшие события": "SELECT id FROM events WHERE time < '2000-01-01' ORDER BY time, id LIMIT 500",
+    "наступившие задачи": "SELECT id FROM scheduled_jobs WHERE due_at <= '2000-01-01' ORDER BY due_at, id LIMIT 500",
+    "участники событий пачки": """
+        SELECT participants.event_id, users.id FROM participants JOIN users ON users.id = participants.user_id
+        WHERE participants.event_id IN (1, 2, 3) AND NOT EXISTS (
+            SELECT 1 FROM blocked_participants WHERE blocked_participants.event_id = participants.event_id
+                AND blocked_participants.user_id = participants.user_id
+        )
+    """,
+}
+
+_FULL_SCAN = re.compile(r"^SCAN (\w+)(?! USING (?:COVERING )?INDEX)")
+
+
+def check_query_plans(bind=engine):
+    """Проверить планы горячих запросов. Вернуть список (запрос, строка плана) с полным сканированием."""
+    problems = []
+    with bind.connect() as connection:
+        for name, sql in HOT_QUERIES.items():
+            for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"):
+                detail = row[-1]
+                if _FULL_SCAN.match(detail):
+                    problems.append((name, detail))
+    return problems
+
+
+if __name__ == "__main__":
+    # python migrations.py — применить миграции и проверить планы запросов (код возврата 1 при сканировании)
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    full_scans = check_query_plans()
+    for name, detail in full_scans:
+        print(f"Полное сканирование в запросе «{name}»: {detail}")
+    sys.exit(1 if full_scans else 0)
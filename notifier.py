@@ -0,0 +1,135 @@
+"""Массовая рассылка сообщений с учётом лимитов Telegram Bot API."""
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = 30          # сообщений в секунду на бота
+GLOBAL_BURST = 30         # сколько сообщений можно отправить подряд без ожидания
+PER_CHAT_INTERVAL = 1.0   # минимальный интервал между сообщениями в один чат, секунды
+MAX_CONCURRENCY = 16      # одновременных запросов к Bot API
+MAX_ATTEMPTS = 3          # попыток на получателя при сетевых ошибках
+
+# Результат доставки одному получателю
+Delivery = namedtuple("Delivery", ["chat_id", "ok", "error"])
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate операций в секунду с запасом burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = None
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        """Остановить выдачу токенов, например после RetryAfter."""
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._updated is None:
+                self._updated = now
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Notifier:
+    """Общий для всех рассылок движок: ограничение параллельности, глобальный и по-чатовый лимиты, повторы."""
+
+    def __init__(self, rate=GLOBAL_RATE, burst=GLOBAL_BURST, per_chat_interval=PER_CHAT_INTERVAL,
+                 concurrency=MAX_CONCURRENCY, attempts=MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate, burst)
+        self.per_chat_interval = per_chat_interval
+        self.attempts = attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next_send = {}
+
+    async def _wait_for_chat(self, chat_id):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        next_send = self._chat_next_send.get(chat_id, now)
+        # Резервируем слот заранее, чтобы параллельные отправки в один чат выстроились в очередь
+        self._chat_next_send[chat_id] = max(next_send, now) + self.per_chat_interval
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+
+    def _forget_idle_chats(self):
+        now = asyncio.get_running_loop().time()
+        self._chat_next_send = {
+            chat_id: next_send for chat_id, next_send in self._chat_next_send.items() if next_send > now
+        }
+
+    async def _deliver(self, bot, chat_id, text):
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            # Ожидание своего слота в чате не занимает места среди MAX_CONCURRENCY отправок
+            await self._wait_for_chat(chat_id)
+            async with self._semaphore:
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                    return Delivery(chat_id, True, None)
+                except RetryAfter as e:
+                    retry_after = e.retry_after
+                    if isinstance(retry_after, timedelta):
+                        retry_after = retry_after.total_seconds()
+                    logger.warning("RetryAfter %s с при отправке в чат %s", retry_after, chat_id)
+                    self.bucket.pause(retry_after)
+                    error = e
+                    continue
+                except (BadRequest, Forbidden) as e:
+                    # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+                    return Delivery(chat_id, False, e)
+                except NetworkError as e:
+                    error = e
+                except TelegramError as e:
+                    # ChatMigrated, InvalidToken и прочее: повтор не поможет, а исключение из gather
+                    # оборвало бы рассылку остальным получателям
+                    logger.warning("Ошибка Bot API при отправке в чат %s: %s", chat_id, e)
+                    return Delivery(chat_id, False, e)
+            # TimedOut и прочие сетевые сбои: повторяем с экспоненциальной задержкой
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        return Delivery(chat_id, False, error)
+
+    async def send_many(self, bot, messages):
+        """Разослать сообщения [(chat_id, text), ...] и вернуть список Delivery в том же порядке."""
+        try:
+            return await asyncio.gather(*(self._deliver(bot, chat_id, text) for chat_id, text in messages))
+        finally:
+            self._forget_idle_chats()
+
+
+notifier = Notifier()
+
+
+async def notify_users(bot, users, text):
+    """Отправить одинаковый текст участникам [{"id": ..., "username": ...}] и залогировать неудачи."""
+    return await notify_many(bot, [(user["id"], text) for user in users])
+
+
+async def notify_many(bot, messages):
+    """Разослать сообщения [(chat_id, text), ...] одной пачкой и залогировать неудачи."""
+    deliveries = await notifier.send_many(bot, messages)
+    failed = [delivery for delivery in deliveries if not delivery.ok]
+    for delivery in failed:
+        logger.warning("Не удалось отправить сообщение пользователю %s: %s", delivery.chat_id, delivery.error)
+    logger.info("Рассылка: доставлено %d из %d", len(deliveries) - len(failed), len(deliveries))
+    return deliveries
@@ -0,0 +1,151 @@
+"""Хранение состояния диалогов, user_data, chat_data и bot_data в базе бота.
+
+Application раз в update_interval секунд передаёт в persistence данные затронутых пользователей
+и чатов. SQLitePersistence сравнивает их с последней записанной версией, запоминает только
+изменившиеся ключи и записывает их одной транзакцией через flush_delay секунд после первого
+изменения. Стоимость записи зависит от числа изменений, а не от числа пользователей.
+"""
+import asyncio
+import json
+import logging
+import os
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import run_db, load_persisted_data, load_conversation_states, save_persistence_batch
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передаёт изменения в persistence и сколько ждать перед записью в базу, секунды
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "1"))
+
+USER_DATA = "user"
+CHAT_DATA = "chat"
+BOT_DATA = "bot"
+
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence поверх таблиц persisted_data и conversation_states.
+
+    Данные хранятся в pickle, как в PicklePersistence, но каждая запись — отдельная строка.
+    Пустые user_data и chat_data не хранятся. callback_data не сохраняется: бот его не использует.
+    """
+
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL, flush_delay=PERSISTENCE_FLUSH_DELAY):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.flush_delay = flush_delay
+        self._written = {}  # (вид, ключ) -> pickle, последняя записанная или загруженная версия
+        self._dirty = {}  # (вид, ключ) -> pickle или None для удаления
+        self._dirty_conversations = {}  # (имя, ключ JSON) -> состояние JSON или None для удаления
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def _load(self, kind):
+        rows = await run_db(load_persisted_data, kind)
+        data = {}
+        for key, blob in rows.items():
+            self._written[(kind, key)] = blob
+            data[key] = pickle.loads(blob)
+        return data
+
+    def _mark(self, kind, key, data):
+        """Запомнить изменение, если данные отличаются от последней записанной версии."""
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL) if data else None
+        if self._written.get((kind, key)) == blob:
+            return
+        if blob is None:
+            self._written.pop((kind, key), None)
+        else:
+            self._written[(kind, key)] = blob
+        self._dirty[(kind, key)] = blob
+        self._schedule_flush()
+
+    def _drop(self, kind, key):
+        if self._written.pop((kind, key), None) is not None:
+            self._dirty[(kind, key)] = None
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Изменения, пришедшие за время ожидания, попадут в ту же транзакцию
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self._flush_pending()
+
+    async def _flush_pending(self):
+        async with self._write_lock:
+            data, self._dirty = self._dirty, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not data and not conversations:
+                return
+            try:
+                await run_db(save_persistence_batch, data, conversations)
+            except Exception:
+                logger.exception("Не удалось записать %d изменений persistence, повторим позже",
+                                 len(data) + len(conversations))
+                # Более свежие изменения, пришедшие во время записи, важнее неудавшихся
+                self._dirty = {**data, **self._dirty}
+                self._dirty_conversations = {**conversations, **self._dirty_conversations}
+                self._schedule_flush()
+                return
+        logger.debug("Записано изменений persistence: %d", len(data) + len(conversations))
+
+    async def get_user_data(self):
+        return await self._load(USER_DATA)
+
+    async def get_chat_data(self):
+        return await self._load(CHAT_DATA)
+
+    async def get_bot_data(self):
+        return (await self._load(BOT_DATA)).get(0, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await run_db(load_conversation_states, name)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._mark(USER_DATA, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(CHAT_DATA, chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._mark(BOT_DATA, 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._dirty_conversations[(name, json.dumps(key))] = None if new_state is None else json.dumps(new_state)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._drop(USER_DATA, user_id)
+
+    async def drop_chat_data(self, chat_id):
+        self._drop(CHAT_DATA, chat_id)
+
+    # Данные живут в памяти приложения и меняются только им, перечитывать их из базы не нужно
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Записать все накопленные изменения; Application вызывает это при остановке."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush_pending()
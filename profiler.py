@@ -0,0 +1,104 @@
+"""Выборочное профилирование медленных обновлений.
+
+Включается переменной PROFILE_SAMPLE_RATE — долей обновлений, которые обрабатываются под cProfile
+(например, 0.01). Если такое обновление выполнялось дольше PROFILE_SLOW_SECONDS, в PROFILE_DIR
+записывается отчёт pstats с меткой обработчика, префиксом callback_data и числом SQL-запросов;
+хранятся только последние PROFILE_KEEP отчётов. Необработанные выборкой обновления стоят одного
+вызова random().
+
+cProfile работает в потоке цикла событий, поэтому профилируется не больше одного обновления
+одновременно, а в отчёт попадают и корутины, выполнявшиеся параллельно с ним. Ожидание базы
+и Telegram видно как время внутри select() цикла событий; сами запросы идут в потоках базы,
+их число и время (при включённых метриках) указаны в заголовке отчёта.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+from datetime import datetime
+
+from telegram import Update
+from telegram_bot_calendar.base import CB_CALENDAR
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_TOP = 40  # строк pstats в отчёте
+ENABLED = PROFILE_SAMPLE_RATE > 0
+
+_active = False
+
+
+def start():
+    """Начать профилирование обновления с вероятностью PROFILE_SAMPLE_RATE. Вернуть профиль или None."""
+    global _active
+    if _active or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Уже работает другой профилировщик
+        return None
+    _active = True
+    return profile
+
+
+def finish(profile, update, seconds, uow):
+    """Остановить профилирование и, если обновление было медленным, записать отчёт в фоновом потоке."""
+    global _active
+    profile.disable()
+    _active = False
+    if seconds < PROFILE_SLOW_SECONDS:
+        return
+    header = {
+        "обработчик": metrics.update_label(update),
+        "префикс callback_data": _callback_prefix(update),
+        "время, с": f"{seconds:.3f}",
+    }
+    if uow is not None:
+        header["SQL-запросов"] = uow.queries
+        if metrics.ENABLED:
+            header["время SQL, с"] = f"{uow.query_seconds:.3f}"
+    asyncio.get_running_loop().run_in_executor(None, _write_report, profile, header)
+
+
+def _callback_prefix(update):
+    if not isinstance(update, Update) or update.callback_query is None:
+        return "-"
+    data = update.callback_query.data or ""
+    # Версия формата и код команды, без аргументов; у календаря — только его префикс
+    return CB_CALENDAR if data.startswith(f"{CB_CALENDAR}_") else data[:2]
+
+
+def _write_report(profile, header):
+    try:
+        stream = io.StringIO()
+        for key, value in header.items():
+            stream.write(f"{key}: {value}\n")
+        stream.write("\n")
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{header['обработчик']}.txt"
+        with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as file:
+            file.write(stream.getvalue())
+        _prune()
+        logger.warning("Медленное обновление (%s, %s с), профиль: %s", header["обработчик"], header["время, с"], name)
+    except Exception:
+        logger.exception("Не удалось записать профиль медленного обновления")
+
+
+def _prune():
+    """Оставить последние PROFILE_KEEP отчётов; имена начинаются со времени, поэтому сортируются по нему."""
+    reports = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".txt"))
+    for name in reports[:-PROFILE_KEEP]:
+        os.remove(os.path.join(PROFILE_DIR, name))
@@ -0,0 +1,106 @@
+"""Перерисовка сообщений бота без лишних запросов к Bot API.
+
+edit_message запоминает хэш последнего отправленного текста и клавиатуры для каждого сообщения
+(чат, message_id) и не отправляет редактирование, если содержимое не изменилось: Telegram всё
+равно ответил бы «message is not modified». Кроме того, редактирования одного сообщения
+склеиваются: первое уходит сразу, а пришедшие в течение RENDER_COALESCE_WINDOW секунд после него
+заменяют друг друга, и по истечении окна отправляется только последнее. Так серия быстрых нажатий
+«Присоединиться» / «Покинуть» даёт одно-два редактирования вместо одного на каждое нажатие.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+RENDER_COALESCE_WINDOW = float(os.getenv("RENDER_COALESCE_WINDOW", "0.3"))  # секунды
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "10000"))  # сколько сообщений помнить
+
+
+class _Slot:
+    """Состояние одного сообщения: что отправлено последним и что ждёт конца окна."""
+
+    __slots__ = ("sent", "next_at", "pending", "task")
+
+    def __init__(self):
+        self.sent = None  # хэш последнего отправленного содержимого
+        self.next_at = 0.0  # время цикла событий, раньше которого новое редактирование ждёт
+        self.pending = None  # (message, text, reply_markup, хэш) для отложенного редактирования
+        self.task = None
+
+
+_slots = OrderedDict()  # (chat_id, message_id) -> _Slot
+
+
+def _digest(text, reply_markup):
+    if reply_markup is None:
+        markup = ""
+    elif isinstance(reply_markup, str):
+        markup = reply_markup  # клавиатуры календаря уже в JSON
+    else:
+        markup = reply_markup.to_json()
+    return hash((text, markup))
+
+
+def _slot(key):
+    slot = _slots.get(key)
+    if slot is None:
+        slot = _slots[key] = _Slot()
+        if len(_slots) > RENDER_CACHE_SIZE:
+            _slots.popitem(last=False)
+    else:
+        _slots.move_to_end(key)
+    return slot
+
+
+async def _send(slot, message, text, reply_markup, digest):
+    previous, slot.sent = slot.sent, digest
+    slot.next_at = asyncio.get_running_loop().time() + RENDER_COALESCE_WINDOW
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            slot.sent = previous
+            raise
+    except Exception:
+        slot.sent = previous
+        raise
+
+
+async def _flush_later(key, slot):
+    try:
+        await asyncio.sleep(max(slot.next_at - asyncio.get_running_loop().time(), 0))
+        message, text, reply_markup, digest = slot.pending
+        slot.pending = None
+        if digest != slot.sent:
+            await _send(slot, message, text, reply_markup, digest)
+    except Exception:
+        logger.exception("Не удалось отправить отложенное редактирование сообщения %s", key)
+    finally:
+        slot.task = None
+
+
+async def edit_message(message, text, reply_markup=None):
+    """Отредактировать сообщение бота, если его содержимое изменилось.
+
+    Вне окна склейки редактирование отправляется сразу и ошибки Bot API передаются вызывающему.
+    Внутри окна оно откладывается, функция возвращается сразу, а ошибки отложенной отправки только
+    логируются.
+    """
+    key = (message.chat_id, message.message_id)
+    slot = _slot(key)
+    digest = _digest(text, reply_markup)
+
+    if slot.task is None:
+        if digest == slot.sent:
+            return
+        if asyncio.get_running_loop().time() >= slot.next_at:
+            await _send(slot, message, text, reply_markup, digest)
+            return
+
+    slot.pending = (message, text, reply_markup, digest)
+    if slot.task is None:
+        slot.task = asyncio.create_task(_flush_later(key, slot))
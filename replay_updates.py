@@ -0,0 +1,58 @@
+"""Отправить записанные обновления Telegram в webhook бота.
+
+Файл — JSON-массив обновлений или по одному обновлению в строке (JSON Lines).
+Пример: python replay_updates.py updates.jsonl --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+import httpx
+from dotenv import load_dotenv
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as file:
+        content = file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+async def replay(url, updates, secret=None, concurrency=10):
+    """POST-запросы с обновлениями; возвращает счётчик HTTP-статусов и время в секундах."""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = Counter()
+
+    async with httpx.AsyncClient(headers=headers, timeout=30) as client:
+        async def post(update):
+            async with semaphore:
+                response = await client.post(url, json=update)
+                statuses[response.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        return statuses, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    default_url = "http://{}:{}/{}".format(
+        os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+        os.getenv("WEBHOOK_PORT", "8443"),
+        os.getenv("WEBHOOK_PATH", "telegram"),
+    )
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="файл с обновлениями")
+    parser.add_argument("--url", default=default_url)
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    updates = load_updates(args.path)
+    statuses, elapsed = asyncio.run(replay(args.url, updates, args.secret, args.concurrency))
+    print(f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.1f}/с): {dict(statuses)}")
@@ -0,0 +1,98 @@
+"""Маршрутизация callback_data по префиксу вместо цепочки CallbackQueryHandler с регулярками."""
+import functools
+import logging
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+import callbacks
+from callback_ack import answer_callback
+
+logger = logging.getLogger(__name__)
+
+
+class _Node:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None   # (handler, parse) для полного совпадения
+        self.prefix = None  # (handler, parse) для совпадения по префиксу
+
+
+class CallbackRouter:
+    """Префиксное дерево: поиск обработчика занимает O(длины callback_data), а не O(числа обработчиков).
+
+    Обработчик вызывается как handler(update, context, *args), где args — результат parse(хвост)
+    для маршрута по префиксу. Побеждает самый длинный подходящий префикс.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._fallbacks = []
+
+    def _node(self, key):
+        node = self._root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+        return node
+
+    def add_exact(self, data, handler):
+        self._node(data).exact = (handler, None)
+
+    def add_prefix(self, prefix, handler, parse):
+        self._node(prefix).prefix = (handler, parse)
+
+    def add_command(self, op, handler, convert=None):
+        """Маршрут для команды из callbacks: аргументы разбираются по callbacks.ARG_TYPES.
+
+        convert(*args) может превратить разобранные аргументы в параметры обработчика.
+        """
+        if not callbacks.ARG_TYPES[op]:
+            self.add_exact(callbacks.encode(op), handler)
+            return
+        decode = functools.partial(callbacks.decode_args, op)
+        if convert is not None:
+            decode = lambda rest, decode=decode: convert(*decode(rest))
+        self.add_prefix(callbacks.prefix(op), handler, decode)
+
+    def add_fallback(self, matches, handler):
+        """Обработчик для данных, не попавших в дерево, например callback_data календаря."""
+        self._fallbacks.append((matches, handler))
+
+    def resolve(self, data):
+        """Найти (handler, args) для callback_data или None."""
+        node = self._root
+        best = None
+        for index, char in enumerate(data):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.prefix is not None:
+                best = node.prefix, index + 1
+        else:
+            if node.exact is not None:
+                return node.exact[0], ()
+
+        if best is not None:
+            (handler, parse), end = best
+            return handler, parse(data[end:])
+
+        for matches, handler in self._fallbacks:
+            if matches(data):
+                return handler, ()
+        return None
+
+    async def dispatch(self, update: Update, context: CallbackContext):
+        query = update.callback_query
+        try:
+            route = self.resolve(query.data or "")
+        except ValueError:
+            logger.warning("Некорректные данные кнопки: %s", query.data)
+            await answer_callback(query, "Некорректные данные кнопки.")
+            return
+        if route is None:
+            await answer_callback(query, "Эта кнопка устарела.")
+            return
+        handler, args = route
+        return await handler(update, context, *args)
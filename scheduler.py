@@ -1,81 +1,137 @@
 from telegram.ext import CallbackContext
-import telegram
-
-
-def get_participants(event_id):
-    from database import SessionLocal, Participant, User, BlockedParticipant
-    """Получить список участников события, исключая заблокированных."""
-    with SessionLocal() as session:
-        participants = (
-            session.query(User.id, User.username)
-            .join(Participant, User.id == Participant.user_id)
-            .filter(Participant.event_id == event_id)
-            .filter(~session.query(BlockedParticipant).filter(
-                BlockedParticipant.event_id == event_id,
-                BlockedParticipant.user_id == User.id
-            ).exists())
-            .all()
-        )
-    return [{"id": participant[0], "username": participant[1]} for participant in participants]
-
-
-
-
-async def send_reminder(context: CallbackContext):
-    print("send_reminder вызвана")
-    job_data = context.job.data
-    event_id = job_data.get("event_id")
-    event_name = job_data.get("event_name")
-
-    # Получаем участников события
-    participants = get_participants(event_id)
-
-    if not participants:
-        print(f"Участников для события {event_id} нет.")
-        return None
-
-    # Отправляем напоминания участникам
-    for user in participants:
-        try:
-            await context.bot.send_message(
-                chat_id=user["id"],  # Используем ID для отправки
-                text=f"Напоминание: Событие '{event_name}' начнётся через час!"
-            )
-        except telegram.error.BadRequest as e:
-            print(f"Ошибка при отправке сообщения для {user['username']} ({user['id']}): {e}")
-
-
-
-
-async def start_event(context: CallbackContext):
-    from database import SessionLocal, Participant, Event, BlockedParticipant
-    print("start_event вызвана")
-    job_data = context.job.data
-    event_id = job_data.get("event_id")
-    event_name = job_data.get("event_name")
-
-    # Получаем участников события
-    participants = get_participants(event_id)
-
-    # Отправляем уведомления участникам
-    for user in participants:
-        try:
-            await context.bot.send_message(
-                chat_id=user["id"],
-                text=f"Событие '{event_name}' началось!"
-            )
-        except telegram.error.BadRequest as e:
-            print(f"Ошибка при отправке сообщения для {user['username']} ({user['id']}): {e}")
-
-    # Удаляем событие и связанные данные из базы данных
-    with SessionLocal() as session:
-        session.query(Participant).filter(Participant.event_id == event_id).delete()
-        session.query(BlockedParticipant).filter(BlockedParticipant.event_id == event_id).delete()
-        session.query(Event).filter(Event.id == event_id).delete()
-        session.commit()
-        print(f"Событие {event_id} и связанные данные успешно удалены.")
-
-
-
-
-
+from datetime import timedelta
+import logging
+import os
+import metrics
+from notifier import notify_many
+from database import (
+    run_db, take_due_jobs, drop_missed_reminders, purge_expired_events, optimize_db, moscow_now,
+    JOB_REMINDER, DUE_JOBS_BATCH, PURGE_CHUNK
+)
+
+logger = logging.getLogger(__name__)
+
+# События, начавшиеся раньше этого срока, пока бот был выключен, удаляются без уведомлений
+STALE_EVENT_GRACE = timedelta(hours=1)
+
+# Как часто удаляются прошедшие события, задачи которых потерялись, секунды
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "900"))
+
+# Как часто планировщик проверяет наступившие задачи, секунды
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "10"))
+
+# Режим дайджеста (DIGEST_WINDOW > 0, секунды): уведомления, наступившие в пределах окна, приходят
+# получателю одним сообщением. Окно задаёт интервал проверки, поэтому уведомление задерживается
+# не больше чем на DIGEST_WINDOW секунд.
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "0"))
+SCHEDULER_INTERVAL = max(SCHEDULER_TICK, DIGEST_WINDOW)
+
+# Формы слов для 1, 2–4 и 5+ в винительном падеже: "через 1 день", "через 2 часа", "через 5 минут"
+_UNITS = (
+    (86400, ("день", "дня", "дней")),
+    (3600, ("час", "часа", "часов")),
+    (60, ("минуту", "минуты", "минут")),
+)
+
+
+def _plural(number, forms):
+    if number % 10 == 1 and number % 100 != 11:
+        return forms[0]
+    if 2 <= number % 10 <= 4 and not 12 <= number % 100 <= 14:
+        return forms[1]
+    return forms[2]
+
+
+def format_offset(delta):
+    """Сдвиг до начала события словами: "через час", "через 1 день 2 часа", "через 10 минут"."""
+    seconds = int(delta.total_seconds())
+    parts = []
+    for size, forms in _UNITS:
+        number, seconds = divmod(seconds, size)
+        if number:
+            parts.append((number, _plural(number, forms)))
+    if not parts:
+        return "меньше чем через минуту"
+    if len(parts) == 1 and parts[0][0] == 1:
+        return f"через {parts[0][1]}"
+    return "через " + " ".join(f"{number} {word}" for number, word in parts)
+
+
+def _job_text(job):
+    if job["kind"] == JOB_REMINDER:
+        # Сдвиг берётся из самой задачи, так что текст верен для любого из REMINDER_OFFSETS
+        when = format_offset(job["event_time"] - job["due_at"])
+        return f"Напоминание: Событие '{job['event_name']}' начнётся {when}!"
+    return f"Событие '{job['event_name']}' началось!"
+
+
+def _job_messages(jobs):
+    """Сообщения [(chat_id, text)] по задачам пачки: по одному на задачу и участника,
+    а в режиме дайджеста — одно на получателя со списком всех его уведомлений."""
+    if not DIGEST_WINDOW:
+        return [(participant["id"], _job_text(job)) for job in jobs for participant in job["participants"]]
+
+    lines = {}
+    for job in jobs:
+        for participant in job["participants"]:
+            lines.setdefault(participant["id"], []).append(_job_text(job))
+    return [
+        (chat_id, texts[0] if len(texts) == 1 else "Ваши события:\n" + "\n".join(f"• {text}" for text in texts))
+        for chat_id, texts in lines.items()
+    ]
+
+
+async def process_due_jobs(context: CallbackContext):
+    """Периодическая задача планировщика: выполнить все задачи, время которых наступило.
+
+    Вместо отдельной задачи JobQueue на каждое напоминание и начало события бот раз в SCHEDULER_INTERVAL
+    секунд забирает наступившие задачи из базы пачками по DUE_JOBS_BATCH (по индексу due_at).
+    Участники всех событий пачки загружаются одним запросом, уведомления уходят одной рассылкой,
+    так что память зависит от размера пачки, а не от числа будущих событий.
+    """
+    now = moscow_now()
+    while True:
+        jobs = await run_db(take_due_jobs, now)
+        if not jobs:
+            return
+        if metrics.ENABLED:
+            metrics.observe_job_lag(jobs)
+        messages = _job_messages(jobs)
+        logger.info("Выполнено задач: %d, уведомлений: %d", len(jobs), len(messages))
+        if messages:
+            await notify_many(context.bot, messages)
+        if len(jobs) < DUE_JOBS_BATCH:
+            return
+
+
+async def purge_expired(before):
+    """Удалить события, начавшиеся раньше before, порциями по PURGE_CHUNK. Вернуть их число.
+
+    Каждая порция — отдельная транзакция, между ними обработчики обновлений успевают писать в базу.
+    """
+    total = 0
+    while True:
+        deleted = await run_db(purge_expired_events, before)
+        total += deleted
+        if deleted < PURGE_CHUNK:
+            return total
+
+
+async def sweep_stale_events(application):
+    """При запуске удалить события, которые начались, пока бот был выключен, и их пропущенные напоминания."""
+    now = moscow_now()
+    await run_db(drop_missed_reminders, now)
+    swept = await purge_expired(now - STALE_EVENT_GRACE)
+    logger.info("Удалено устаревших событий: %d", swept)
+
+
+async def purge_expired_job(context: CallbackContext):
+    """Периодическая задача: удалить прошедшие события, которые не удалились при наступлении начала."""
+    purged = await purge_expired(moscow_now() - STALE_EVENT_GRACE)
+    if purged:
+        logger.info("Удалено прошедших событий: %d", purged)
+
+
+async def db_maintenance(context: CallbackContext):
+    """Периодическая задача обслуживания базы (PRAGMA optimize и checkpoint WAL)."""
+    await run_db(optimize_db)
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+# Модули бота создают engine при импорте, поэтому база тестов задаётся до первого импорта database
+_db_dir = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def bot_api():
+    """Заглушка Bot API из fake_bot_api.py: Application.initialize() и запросы бота идут в неё."""
+    from fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI().start()
+    yield api
+    api.stop()
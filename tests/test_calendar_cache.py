@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from telegram_bot_calendar import DetailedTelegramCalendar
+from telegram_bot_calendar.base import CB_CALENDAR, DAY, GOTO, MONTH, NOTHING, SELECT, YEAR
+
+import calendar_cache
+
+
+def _payloads():
+    today = calendar_cache._today()
+    payloads = [f"{CB_CALENDAR}_0_{NOTHING}_{DAY}_{today.year}_{today.month}_1"]
+    for year in (today.year, today.year + 1, today.year + 7):
+        for month in (1, today.month, 12):
+            for step in (YEAR, MONTH, DAY):
+                payloads.append(f"{CB_CALENDAR}_0_{GOTO}_{step}_{year}_{month}_1")
+            for step in (YEAR, MONTH):
+                payloads.append(f"{CB_CALENDAR}_0_{SELECT}_{step}_{year}_{month}_1")
+            payloads.append(f"{CB_CALENDAR}_0_{SELECT}_{DAY}_{year}_{month}_15")
+    return payloads
+
+
+def _buttons(keyboard):
+    return json.loads(keyboard)["inline_keyboard"] if keyboard else None
+
+
+@pytest.mark.parametrize("data", _payloads())
+def test_process_matches_library(data):
+    expected = DetailedTelegramCalendar(min_date=calendar_cache._today()).process(data)
+    result, keyboard, step = calendar_cache.process_calendar(data)
+    # Повторное нажатие отдаёт клавиатуру из кэша, она должна быть той же
+    cached = calendar_cache.process_calendar(data)[1]
+    assert (result, step) == (expected[0], expected[2])
+    assert _buttons(keyboard) == _buttons(cached) == _buttons(expected[1])
+
+
+def test_first_step_matches_library():
+    keyboard, step = calendar_cache.build_calendar()
+    # Бот считает «сегодня» по Москве, библиотека по умолчанию — по часам сервера
+    today = calendar_cache._today()
+    expected = DetailedTelegramCalendar(current_date=today, min_date=today).build()
+    assert step == expected[1]
+    assert _buttons(keyboard) == _buttons(expected[0])
+
+
+def test_forged_years_do_not_grow_cache():
+    today = calendar_cache._today()
+    for year in range(2100, 2100 + calendar_cache.CALENDAR_CACHE_SIZE + 100):
+        calendar_cache.process_calendar(f"{CB_CALENDAR}_0_{GOTO}_{DAY}_{year}_{today.month}_1")
+    assert len(calendar_cache._keyboards) == calendar_cache.CALENDAR_CACHE_SIZE
+
+
+@pytest.mark.parametrize("data", ["join_1", f"{CB_CALENDAR}_0_{GOTO}_{DAY}_2030", f"{CB_CALENDAR}_0_zz_d_2030_1_1"])
+def test_malformed_payload(data):
+    with pytest.raises(ValueError):
+        calendar_cache.process_calendar(data)
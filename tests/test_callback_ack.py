@@ -0,0 +1,58 @@
+import asyncio
+
+import callback_ack
+
+
+class FakeQuery:
+    def __init__(self, query_id="1"):
+        self.id = query_id
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+
+def test_deadline_counts_from_handler_start(monkeypatch):
+    monkeypatch.setattr(callback_ack, "CALLBACK_ACK_DEADLINE", 0.05)
+    monkeypatch.setattr(callback_ack, "CALLBACK_ACK_QUEUE_LIMIT", 5)
+
+    async def scenario():
+        query = FakeQuery()
+        callback_ack.start(query)
+        # Нажатие дольше CALLBACK_ACK_DEADLINE ждёт очереди чата, но ещё не отвечено
+        await asyncio.sleep(0.1)
+        assert query.answers == []
+        callback_ack.begin(query)
+        await callback_ack.answer_callback(query, "Вы присоединились", show_alert=True)
+        await callback_ack.finish(query)
+        return query.answers
+
+    assert asyncio.run(scenario()) == [("Вы присоединились", True)]
+
+
+def test_deadline_answer_is_marked_before_it_runs():
+    async def scenario():
+        query = FakeQuery()
+        callback_ack.start(query)
+        # Таймер сработал, а задача с пустым ответом ещё не запускалась
+        callback_ack._answer_on_deadline(callback_ack._pending[query.id])
+        await callback_ack.answer_callback(query, "Подсказка")
+        await callback_ack.finish(query)
+        await asyncio.gather(*callback_ack._tasks)
+        return query.answers
+
+    assert asyncio.run(scenario()) == [(None, False)]
+
+
+def test_queue_limit_answers_waiting_tap(monkeypatch):
+    monkeypatch.setattr(callback_ack, "CALLBACK_ACK_QUEUE_LIMIT", 0.01)
+
+    async def scenario():
+        query = FakeQuery()
+        callback_ack.start(query)
+        await asyncio.sleep(0.05)
+        callback_ack.begin(query)
+        await callback_ack.finish(query)
+        return query.answers
+
+    assert asyncio.run(scenario()) == [(None, False)]
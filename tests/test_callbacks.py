@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+import callbacks
+
+WHEN = datetime(2031, 5, 17, 18, 30)
+
+SAMPLE_ARGS = {int: 2000000000, datetime: WHEN}
+
+
+@pytest.mark.parametrize("op", sorted(callbacks.ARG_TYPES))
+def test_round_trip(op):
+    args = tuple(SAMPLE_ARGS[kind] for kind in callbacks.ARG_TYPES[op])
+    data = callbacks.encode(op, *args)
+    assert len(data.encode()) <= callbacks.MAX_LENGTH
+    assert callbacks.decode(data) == (op, args)
+
+
+def test_round_trip_edge_values():
+    data = callbacks.encode(callbacks.LIST_EVENTS_PAGE, callbacks.PAGE_PREV, callbacks.EPOCH, 0)
+    assert data == "1L.0.0.0"
+    assert callbacks.decode(data) == (callbacks.LIST_EVENTS_PAGE, (callbacks.PAGE_PREV, callbacks.EPOCH, 0))
+    # Идентификаторы групповых чатов отрицательные
+    data = callbacks.encode(callbacks.REMOVE_PARTICIPANT, 7, -1001234567890)
+    assert callbacks.decode(data) == (callbacks.REMOVE_PARTICIPANT, (7, -1001234567890))
+
+
+def test_decode_args_after_prefix():
+    data = callbacks.encode(callbacks.MANAGE_DATE, WHEN)
+    prefix = callbacks.prefix(callbacks.MANAGE_DATE)
+    assert data.startswith(prefix)
+    assert callbacks.decode_args(callbacks.MANAGE_DATE, data[len(prefix):]) == (WHEN,)
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    "1",
+    "2m",  # другая версия формата
+    "1?",  # неизвестная команда
+    "remove_participant_1_2",  # старый формат
+    "1m.1",  # лишний аргумент
+    "1j",  # нет аргумента
+    "1jx",
+    "1j.",
+    "1j.1.2",
+    "1j.z!",
+    "1r.1..2",
+    "1t.zzzzzzzzzzzzzzzz",  # дата за пределами datetime
+])
+def test_decode_rejects_malformed(data):
+    with pytest.raises(ValueError):
+        callbacks.decode(data)
+
+
+def test_encode_checks_arguments():
+    with pytest.raises(ValueError):
+        callbacks.encode(callbacks.JOIN_EVENT)
+    with pytest.raises(ValueError):
+        callbacks.encode(callbacks.MAIN_MENU, 1)
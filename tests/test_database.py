@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+from datetime import timedelta
+
+import pytest
+
+import database
+from migrations import migrate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("url", ["sqlite://", "sqlite:///:memory:", "sqlite:///file:bot?mode=memory&uri=true"])
+def test_memory_database_uses_default_pool(url):
+    assert database._engine_options(url) == {}
+
+
+def test_file_database_sizes_pool():
+    assert database._engine_options("sqlite:///events.db") == {
+        "pool_size": database.DB_POOL_SIZE, "max_overflow": database.DB_WORKERS,
+    }
+
+
+def _import_database(**env):
+    return subprocess.run(
+        [sys.executable, "-c", "import database"], cwd=ROOT, env={**os.environ, **env},
+        capture_output=True, text=True,
+    )
+
+
+def test_memory_database_url_imports():
+    result = _import_database(DATABASE_URL="sqlite://")
+    assert result.returncode == 0, result.stderr
+
+
+def test_unknown_profile_is_reported():
+    result = _import_database(DB_PROFILE="fast")
+    assert result.returncode != 0
+    assert "ValueError: Неизвестный профиль хранения DB_PROFILE='fast'" in result.stderr
+    assert "production" in result.stderr
+
+
+@pytest.fixture(scope="module")
+def event_with_blocked_rows():
+    migrate()
+    for user_id in (10, 11, 12):
+        database.add_user_to_db(user_id, f"user{user_id}")
+    event_id = database.save_event("Карточка", database.moscow_now() + timedelta(days=3), 10)
+    # Оставшаяся строка участника, которого уже заблокировали
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO participants (event_id, user_id) VALUES (?, 11)", (event_id,))
+        connection.exec_driver_sql("INSERT INTO blocked_participants (event_id, user_id) VALUES (?, 11)", (event_id,))
+    return event_id
+
+
+def test_event_details_with_only_blocked_participants(event_with_blocked_rows):
+    details = database._load_event_details(event_with_blocked_rows)
+    assert details is not None
+    assert details["name"] == "Карточка"
+    assert details["creator"] == "user10"
+    assert details["participants"] == []
+
+
+def test_event_details_hide_blocked_participants(event_with_blocked_rows):
+    database.save_participant(event_with_blocked_rows, 12)
+    details = database._load_event_details(event_with_blocked_rows)
+    assert details["participants"] == [{"id": 12, "username": "user12"}]
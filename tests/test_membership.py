@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+import pytest
+
+import database
+from database import EVENT_MISSING, MEMBER_ALREADY, MEMBER_BLOCKED, MEMBER_JOINED
+from migrations import migrate
+
+
+@pytest.fixture
+def event_id():
+    migrate()
+    for user_id in (601, 602):
+        database.add_user_to_db(user_id, f"user{user_id}")
+    return database.save_event("Состав", database.moscow_now() + timedelta(days=5), 601)
+
+
+def _members(event_id):
+    return [participant["id"] for participant in database.get_participants(event_id)]
+
+
+def _rows(table, event_id):
+    with database.engine.connect() as connection:
+        return connection.exec_driver_sql(f"SELECT COUNT(*) FROM {table} WHERE event_id = ?", (event_id,)).scalar()
+
+
+def test_join_is_idempotent(event_id):
+    assert database.join_event_member(event_id, 602) == MEMBER_JOINED
+    assert database.join_event_member(event_id, 602) == MEMBER_ALREADY
+    assert _members(event_id) == [602]
+    assert _rows("participants", event_id) == 1
+
+
+def test_join_missing_event():
+    migrate()
+    assert database.join_event_member(10 ** 9, 602) == EVENT_MISSING
+
+
+def test_leave(event_id):
+    database.join_event_member(event_id, 602)
+    assert database.leave_event_member(event_id, 602) is True
+    assert database.leave_event_member(event_id, 602) is False
+    assert _members(event_id) == []
+
+
+def test_kick_blocks_rejoining(event_id):
+    database.join_event_member(event_id, 602)
+    database.kick_event_member(event_id, 602)
+    database.kick_event_member(event_id, 602)  # повторное удаление не создаёт вторую блокировку
+    assert _members(event_id) == []
+    assert _rows("blocked_participants", event_id) == 1
+    assert database.join_event_member(event_id, 602) == MEMBER_BLOCKED
+    assert _rows("participants", event_id) == 0
+
+
+def test_membership_changes_invalidate_event_card(event_id):
+    assert database.get_event_details(event_id)["participants"] == []
+    database.join_event_member(event_id, 602)
+    assert [p["id"] for p in database.get_event_details(event_id)["participants"]] == [602]
+    database.kick_event_member(event_id, 602)
+    assert database.get_event_details(event_id)["participants"] == []
@@ -0,0 +1,168 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
+
+import database
+from database import engine, moscow_now
+from migrations import LATEST_VERSION, _FULL_SCAN, get_version, migrate
+
+# Схема первой версии бота, до миграций
+BASELINE_SCHEMA = [
+    """
+    CREATE TABLE users (
+        id INTEGER NOT NULL,
+        username VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (username)
+    )
+    """,
+    """
+    CREATE TABLE events (
+        id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        time DATETIME NOT NULL,
+        creator_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(creator_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE participants (
+        id INTEGER NOT NULL,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(event_id) REFERENCES events (id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE blocked_participants (
+        id INTEGER NOT NULL,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(event_id) REFERENCES events (id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE user_dates (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        date DATETIME NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (date),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX ix_users_id ON users (id)",
+    "CREATE INDEX ix_events_id ON events (id)",
+    "CREATE INDEX ix_participants_id ON participants (id)",
+    "CREATE INDEX ix_blocked_participants_id ON blocked_participants (id)",
+    "CREATE INDEX ix_user_dates_id ON user_dates (id)",
+]
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    migrate()
+    now = moscow_now()
+    database.add_user_to_db(1, "organizer")
+    database.add_user_to_db(2, "member")
+    event_id = database.save_event("Игра", now + timedelta(minutes=30), 1)
+    database.save_participant(event_id, 2)
+    return event_id, now
+
+
+def _captured_statements(calls):
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        for call in calls:
+            call()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+def _full_scans(statements):
+    problems = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters):
+                detail = row[-1]
+                # INSERT ... SELECT без FROM: единственная «строка» не таблица
+                if _FULL_SCAN.match(detail) and not detail.startswith("SCAN CONSTANT ROW"):
+                    problems.append((" ".join(statement.split()), detail))
+    return problems
+
+
+def test_hot_queries_use_indexes(seeded):
+    event_id, now = seeded
+    later = now + timedelta(days=1)
+
+    def participants_by_event():
+        with database.session_scope() as session:
+            database._query_participants_by_event(session, [event_id, event_id + 1])
+
+    statements = _captured_statements([
+        lambda: database.get_events_page(),
+        lambda: database.get_events_page(after=(now, event_id)),
+        lambda: database.get_events_page(before=(later, event_id)),
+        lambda: database.get_events_page(creator_id=1),
+        lambda: database.get_events_page(creator_id=1, after=(now, event_id)),
+        lambda: database._load_event_details(event_id),
+        participants_by_event,
+        # Последним: задача начала события удаляет его вместе с участниками и пишет в архив
+        lambda: database.take_due_jobs(later),
+    ])
+    assert any("FROM scheduled_jobs" in statement for statement, _ in statements)
+    assert any("DELETE FROM participants" in statement for statement, _ in statements)
+    assert _full_scans(statements) == []
+
+
+def test_migrate_baseline_database(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    event_time = moscow_now().replace(microsecond=0) + timedelta(days=2)
+    with bind.begin() as connection:
+        for ddl in BASELINE_SCHEMA:
+            connection.exec_driver_sql(ddl)
+        connection.exec_driver_sql("INSERT INTO users (id, username) VALUES (1, 'a'), (2, 'b')")
+        connection.exec_driver_sql(
+            "INSERT INTO events (id, name, time, creator_id) VALUES (1, 'Игра', ?, 1)", (event_time,)
+        )
+        # Дубли участника и блокировки, а также строки давно удалённого события 99
+        connection.exec_driver_sql(
+            "INSERT INTO participants (event_id, user_id) VALUES (1, 2), (1, 2), (1, 1), (99, 2)"
+        )
+        connection.exec_driver_sql("INSERT INTO blocked_participants (event_id, user_id) VALUES (1, 1), (1, 1)")
+        connection.exec_driver_sql("INSERT INTO user_dates (user_id, date) VALUES (1, '2030-01-01 00:00:00.000000')")
+
+    migrate(bind=bind)
+
+    with bind.begin() as connection:
+        assert get_version(connection) == LATEST_VERSION == 5
+        participants = connection.exec_driver_sql(
+            "SELECT event_id, user_id FROM participants ORDER BY user_id"
+        ).fetchall()
+        assert participants == [(1, 1), (1, 2)]
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM blocked_participants").scalar() == 1
+        # После пересборки user_dates одна дата может быть у разных пользователей, но не дважды у одного
+        connection.exec_driver_sql("INSERT INTO user_dates (user_id, date) VALUES (2, '2030-01-01 00:00:00.000000')")
+        with pytest.raises(IntegrityError):
+            connection.exec_driver_sql(
+                "INSERT INTO user_dates (user_id, date) VALUES (2, '2030-01-01 00:00:00.000000')"
+            )
+    with bind.connect() as connection:
+        jobs = connection.exec_driver_sql("SELECT kind FROM scheduled_jobs WHERE event_id = 1").scalars().all()
+        assert jobs
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM event_history").scalar() == 0
+    bind.dispose()
@@ -0,0 +1,52 @@
+import asyncio
+
+from telegram.error import ChatMigrated, InvalidToken, TelegramError
+
+from notifier import Notifier
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def test_chat_interval_does_not_hold_concurrency_slot():
+    async def scenario():
+        bot = FakeBot()
+        notifier = Notifier(rate=1000, burst=1000, per_chat_interval=0.2, concurrency=1)
+        deliveries = await notifier.send_many(bot, [(1, "первое"), (1, "второе"), (2, "другой чат")])
+        return bot.sent, deliveries
+
+    sent, deliveries = asyncio.run(scenario())
+    # Второе сообщение в чат 1 ждёт интервала, а чат 2 тем временем получает своё
+    assert sent == [(1, "первое"), (2, "другой чат"), (1, "второе")]
+    assert all(delivery.ok for delivery in deliveries)
+
+
+class FailingBot(FakeBot):
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        await super().send_message(chat_id, text)
+
+
+def test_other_telegram_errors_do_not_abort_the_batch():
+    errors = {2: ChatMigrated(-1002), 3: InvalidToken(), 4: TelegramError("неизвестная ошибка")}
+
+    async def scenario():
+        bot = FailingBot(errors)
+        notifier = Notifier(rate=1000, burst=1000, per_chat_interval=0)
+        deliveries = await notifier.send_many(bot, [(chat_id, "текст") for chat_id in (1, 2, 3, 4, 5)])
+        return bot.sent, deliveries
+
+    sent, deliveries = asyncio.run(scenario())
+    assert sent == [(1, "текст"), (5, "текст")]
+    assert [delivery.ok for delivery in deliveries] == [True, False, False, False, True]
+    assert [delivery.error for delivery in deliveries[1:4]] == [errors[2], errors[3], errors[4]]
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import persistence
+from migrations import migrate
+from persistence import SQLitePersistence
+
+CONVERSATION = "create_event"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def migrated():
+    migrate()
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Пачки, которые persistence записывает в базу."""
+    calls = []
+    save = persistence.save_persistence_batch
+
+    def counting_save(data, conversations):
+        calls.append((dict(data), dict(conversations)))
+        return save(data, conversations)
+
+    counting_save.writes = True
+    monkeypatch.setattr(persistence, "save_persistence_batch", counting_save)
+    return calls
+
+
+async def _reload():
+    """Прочитать сохранённое состояние так, как его читает Application после перезапуска."""
+    restarted = SQLitePersistence()
+    return (
+        await restarted.get_user_data(),
+        await restarted.get_chat_data(),
+        await restarted.get_bot_data(),
+        await restarted.get_conversations(CONVERSATION),
+    )
+
+
+def test_changes_are_written_behind_in_one_batch(batches):
+    async def scenario():
+        store = SQLitePersistence(flush_delay=0.05)
+        await store.update_user_data(501, {"event_name": "Игра"})
+        await store.update_chat_data(501, {"page": 2})
+        await store.update_bot_data({"version": 1})
+        await store.update_conversation(CONVERSATION, (501, 501), 2)
+        # До истечения flush_delay в базе ничего нет
+        before = await _reload()
+        await asyncio.sleep(0.15)
+        return before, await _reload()
+
+    before, after = asyncio.run(scenario())
+    assert 501 not in before[0] and (501, 501) not in before[3]
+    users, chats, bot_data, conversations = after
+    assert users[501] == {"event_name": "Игра"}
+    assert chats[501] == {"page": 2}
+    assert bot_data == {"version": 1}
+    assert conversations[(501, 501)] == 2
+    assert len(batches) == 1
+
+
+def test_unchanged_data_is_not_rewritten(batches):
+    async def scenario():
+        store = SQLitePersistence(flush_delay=0.05)
+        await store.update_user_data(502, {"step": 1})
+        await store.flush()
+        # Перезапуск: загруженная версия считается записанной
+        restarted = SQLitePersistence(flush_delay=0.05)
+        await restarted.get_user_data()
+        await restarted.update_user_data(502, {"step": 1})
+        await asyncio.sleep(0.15)
+
+    asyncio.run(scenario())
+    assert len(batches) == 1
+
+
+def test_ended_conversation_and_dropped_data_are_deleted(batches):
+    async def scenario():
+        store = SQLitePersistence(flush_delay=0.05)
+        await store.update_user_data(503, {"event_name": "Прогулка"})
+        await store.update_conversation(CONVERSATION, (503, 503), 1)
+        await store.flush()
+        await store.drop_user_data(503)
+        await store.update_conversation(CONVERSATION, (503, 503), None)
+        await store.flush()
+        return await _reload()
+
+    users, _, _, conversations = asyncio.run(scenario())
+    assert 503 not in users
+    assert (503, 503) not in conversations
+
+
+def test_failed_write_is_retried(monkeypatch):
+    attempts = []
+    save = persistence.save_persistence_batch
+
+    def flaky_save(data, conversations):
+        attempts.append(len(data))
+        if len(attempts) == 1:
+            raise RuntimeError("база занята")
+        return save(data, conversations)
+
+    flaky_save.writes = True
+    monkeypatch.setattr(persistence, "save_persistence_batch", flaky_save)
+
+    async def scenario():
+        store = SQLitePersistence(flush_delay=0.05)
+        await store.update_user_data(504, {"event_name": "Повтор"})
+        await asyncio.sleep(0.3)
+        return await _reload()
+
+    users, _, _, _ = asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert users[504] == {"event_name": "Повтор"}
@@ -0,0 +1,80 @@
+import asyncio
+import itertools
+from datetime import datetime
+
+import pytest
+from telegram import Bot, Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+import render
+
+_message_ids = itertools.count(1000)
+
+
+def _edits(bot_api, scenario, window=0.3):
+    """Выполнить scenario(message) с настоящим Bot и вернуть число вызовов editMessageText."""
+    async def run():
+        bot = Bot("123456:test", base_url=f"{bot_api.url}/bot")
+        await bot.initialize()
+        message = Message(next(_message_ids), datetime.now(), Chat(1, Chat.PRIVATE), text="Главное меню")
+        message.set_bot(bot)
+        before = bot_api.calls["editMessageText"]
+        try:
+            await scenario(message)
+            # Дождаться отложенных редактирований
+            await asyncio.sleep(window + 0.2)
+        finally:
+            await bot.shutdown()
+        return bot_api.calls["editMessageText"] - before
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch):
+    monkeypatch.setattr(render, "RENDER_COALESCE_WINDOW", 0.3)
+
+
+def test_edits_inside_window_are_coalesced(bot_api):
+    sent = []
+
+    async def scenario(message):
+        await render.edit_message(message, "Участников: 1")
+        # Две перерисовки в течение окна после первой дают одно редактирование — последнее
+        await render.edit_message(message, "Участников: 2")
+        await render.edit_message(message, "Участников: 3")
+        await asyncio.sleep(0.4)
+        sent.append(render._slots[(message.chat_id, message.message_id)].sent)
+
+    assert _edits(bot_api, scenario) == 2
+    assert sent == [render._digest("Участников: 3", None)]
+
+
+def test_identical_edit_is_skipped(bot_api):
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data="1m")]])
+
+    async def scenario(message):
+        await render.edit_message(message, "Карточка", reply_markup=keyboard)
+        await asyncio.sleep(0.4)
+        await render.edit_message(message, "Карточка", reply_markup=keyboard)
+
+    assert _edits(bot_api, scenario) == 1
+
+
+def test_edit_after_window_is_sent_immediately(bot_api):
+    async def scenario(message):
+        await render.edit_message(message, "Первый вариант")
+        await asyncio.sleep(0.4)
+        await render.edit_message(message, "Второй вариант")
+        # Окно истекло: редактирование уже отправлено, а не отложено
+        assert render._slots[(message.chat_id, message.message_id)].task is None
+
+    assert _edits(bot_api, scenario, window=0) == 2
+
+
+def test_coalesced_edit_back_to_sent_content_is_dropped(bot_api):
+    async def scenario(message):
+        await render.edit_message(message, "Вы участвуете")
+        await render.edit_message(message, "Вы не участвуете")
+        await render.edit_message(message, "Вы участвуете")
+
+    assert _edits(bot_api, scenario) == 1
@@ -0,0 +1,73 @@
+import pytest
+
+import callbacks
+from router import CallbackRouter
+
+
+async def main_menu(update, context):
+    pass
+
+
+async def join(update, context, event_id):
+    pass
+
+
+async def page(update, context, direction, when, event_id):
+    pass
+
+
+async def calendar(update, context):
+    pass
+
+
+async def nested(update, context, rest):
+    pass
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+    router.add_command(callbacks.MAIN_MENU, main_menu)
+    router.add_command(callbacks.JOIN_EVENT, join)
+    router.add_command(callbacks.LIST_EVENTS_PAGE, page)
+    router.add_fallback(lambda data: data.startswith("cbcal_"), calendar)
+    return router
+
+
+def test_resolve_exact(router):
+    assert router.resolve(callbacks.encode(callbacks.MAIN_MENU)) == (main_menu, ())
+
+
+def test_resolve_command_args(router):
+    assert router.resolve(callbacks.encode(callbacks.JOIN_EVENT, 123456)) == (join, (123456,))
+    data = callbacks.encode(callbacks.LIST_EVENTS_PAGE, callbacks.PAGE_NEXT, callbacks.EPOCH, 42)
+    assert router.resolve(data) == (page, (callbacks.PAGE_NEXT, callbacks.EPOCH, 42))
+
+
+def test_resolve_convert():
+    router = CallbackRouter()
+    router.add_command(callbacks.JOIN_EVENT, join, convert=lambda event_id: (str(event_id),))
+    assert router.resolve(callbacks.encode(callbacks.JOIN_EVENT, 35)) == (join, ("35",))
+
+
+def test_resolve_longest_prefix():
+    router = CallbackRouter()
+    router.add_prefix("a", join, lambda rest: (rest,))
+    router.add_prefix("ab", nested, lambda rest: (rest,))
+    assert router.resolve("abc") == (nested, ("c",))
+    assert router.resolve("axc") == (join, ("xc",))
+
+
+def test_resolve_fallback(router):
+    assert router.resolve("cbcal_0_d_2031_5_17") == (calendar, ())
+
+
+@pytest.mark.parametrize("data", ["", "join_event_1", "2m", "1x.1"])
+def test_resolve_stale(router, data):
+    assert router.resolve(data) is None
+
+
+@pytest.mark.parametrize("data", ["1j.", "1j.1.2", "1j.z!", "1L.1.zzzzzzzzzzzzzzzz.1"])
+def test_resolve_malformed(router, data):
+    with pytest.raises(ValueError):
+        router.resolve(data)
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import notifier
+import scheduler
+from database import JOB_REMINDER, ScheduledJob
+from migrations import migrate
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture(autouse=True)
+def fast_notifier(monkeypatch):
+    migrate()
+    monkeypatch.setattr(notifier, "notifier", notifier.Notifier(rate=1000, burst=1000, per_chat_interval=0))
+
+
+def _event(name, starts_in, *participants):
+    database.add_user_to_db(701, "organizer701")
+    event_id = database.save_event(name, datetime.now(database.MOSCOW_TZ) + starts_in, 701)
+    for user_id in participants:
+        database.add_user_to_db(user_id, f"user{user_id}")
+        database.save_participant(event_id, user_id)
+    return event_id
+
+
+def _jobs(event_id):
+    with database.session_scope() as session:
+        return sorted(kind for kind, in session.query(ScheduledJob.kind).filter(ScheduledJob.event_id == event_id))
+
+
+def _run_tick():
+    bot = FakeBot()
+    asyncio.run(scheduler.process_due_jobs(SimpleNamespace(bot=bot)))
+    return bot.sent
+
+
+def test_tick_sends_everything_due_in_one_batch():
+    first = _event("Первое", -timedelta(minutes=1), 711, 712)
+    second = _event("Второе", -timedelta(seconds=30), 712)
+    future = _event("Будущее", timedelta(days=2), 711)
+
+    sent = _run_tick()
+
+    assert sorted(message for message in sent if message[0] in (711, 712)) == [
+        (711, "Событие 'Первое' началось!"),
+        (712, "Событие 'Второе' началось!"),
+        (712, "Событие 'Первое' началось!"),
+    ]
+    # Начавшиеся события удалены вместе с задачами, будущее ждёт своих напоминаний
+    assert database.get_event(first) is None and database.get_event(second) is None
+    assert _jobs(first) == [] and _jobs(second) == []
+    assert database.get_event(future) is not None and _jobs(future)
+    # Повторный тик ничего не отправляет повторно
+    assert [message for message in _run_tick() if message[0] in (711, 712)] == []
+
+
+def test_digest_groups_notifications_per_recipient(monkeypatch):
+    monkeypatch.setattr(scheduler, "DIGEST_WINDOW", 60)
+    _event("Матч", -timedelta(minutes=1), 721)
+    _event("Турнир", -timedelta(seconds=10), 721)
+
+    sent = [message for message in _run_tick() if message[0] == 721]
+
+    assert len(sent) == 1
+    assert sent[0][1].startswith("Ваши события:")
+    assert "'Матч'" in sent[0][1] and "'Турнир'" in sent[0][1]
+
+
+def test_restart_sweeps_events_missed_while_offline():
+    stale = _event("Давно прошедшее", -(scheduler.STALE_EVENT_GRACE + timedelta(hours=1)), 731)
+    recent = _event("Только что началось", -timedelta(minutes=10), 731)
+    # Напоминание, которое не успело отправиться, пока бот был выключен
+    with database.session_scope() as session:
+        session.add(ScheduledJob(event_id=recent, kind=JOB_REMINDER, due_at=database.moscow_now()))
+
+    asyncio.run(scheduler.sweep_stale_events(None))
+
+    assert database.get_event(stale) is None
+    # Недавнее событие остаётся: участники получат уведомление о начале, но не устаревшее напоминание
+    assert database.get_event(recent) is not None
+    assert JOB_REMINDER not in _jobs(recent)
+    assert [message for message in _run_tick() if message[0] == 731] == [(731, "Событие 'Только что началось' началось!")]
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from telegram import Chat, Message, Update, User
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+import database
+from bot_context import CONTEXT_TYPES
+from migrations import migrate
+from update_processor import ChatOrderedUpdateProcessor, handle_error
+
+
+@pytest.fixture(scope="module", autouse=True)
+def migrated():
+    migrate()
+    database.add_user_to_db(1, "organizer")
+
+
+def _update(update_id):
+    user = User(1, "organizer", False)
+    message = Message(update_id, datetime.now(), Chat(1, Chat.PRIVATE), from_user=user, text="/start")
+    return Update(update_id, message=message)
+
+
+def _process(bot_api, callback, update):
+    async def scenario():
+        application = (
+            ApplicationBuilder().token("123456:test").base_url(f"{bot_api.url}/bot").updater(None)
+            .concurrent_updates(ChatOrderedUpdateProcessor(4)).context_types(CONTEXT_TYPES).build()
+        )
+        application.add_handler(TypeHandler(Update, callback))
+        application.add_error_handler(handle_error)
+        await application.initialize()
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        finally:
+            await application.shutdown()
+
+    asyncio.run(scenario())
+
+
+def _event_names():
+    with database.session_scope() as session:
+        return {name for name, in session.query(database.Event.name)}
+
+
+def test_failed_handler_rolls_back_its_writes(bot_api):
+    async def handler(update, context):
+        # Чтение до записи: SAVEPOINT записи не должен зафиксировать транзакцию при RELEASE
+        await database.run_db(database.get_events_page)
+        await database.run_db(database.save_event, "Упавшее", database.moscow_now() + timedelta(days=1), 1)
+        raise RuntimeError("ошибка после первой записи")
+
+    _process(bot_api, handler, _update(1))
+    assert "Упавшее" not in _event_names()
+
+
+def test_successful_handler_commits_its_writes(bot_api):
+    async def handler(update, context):
+        await database.run_db(database.save_event, "Сохранённое", database.moscow_now() + timedelta(days=1), 1)
+
+    _process(bot_api, handler, _update(2))
+    assert "Сохранённое" in _event_names()
+
+
+@database.writes
+def _add_duplicate_user():
+    with database.session_scope() as session:
+        session.add(database.User(id=1, username="duplicate"))
+
+
+def test_handled_integrity_error_keeps_other_writes(bot_api):
+    errors = []
+
+    async def handler(update, context):
+        await database.run_db(database.save_event, "До ошибки", database.moscow_now() + timedelta(days=1), 1)
+        try:
+            await database.run_db(_add_duplicate_user)
+        except IntegrityError as e:
+            errors.append(e)
+        await database.run_db(database.save_event, "После ошибки", database.moscow_now() + timedelta(days=1), 1)
+
+    _process(bot_api, handler, _update(3))
+    assert errors
+    assert {"До ошибки", "После ошибки"} <= _event_names()
+
+
+def test_add_date_from_calendar_twice(bot_api):
+    results = []
+
+    async def handler(update, context):
+        for _ in range(2):
+            results.append(await database.run_db(database.add_date, 1, date(2031, 1, 1)))
+            await context.db.commit()
+
+    _process(bot_api, handler, _update(4))
+    assert results == [True, False]
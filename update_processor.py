@@ -0,0 +1,157 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата."""
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import callback_ack
+import log_setup
+import metrics
+import profiler
+from database import current_uow, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений может ждать своей очереди сверх выполняющихся
+QUEUE_FACTOR = 8
+
+
+async def handle_error(update, context):
+    """Обработчик ошибок Application: залогировать ошибку и откатить изменения упавшего обновления.
+
+    Ошибки обработчиков обновлений приходят сюда в той же задаче, что и обновление, поэтому
+    current_uow() — его сессия. Ошибки фоновых задач (context.coroutine) и JobQueue только логируются.
+    """
+    logger.error("Ошибка при обработке обновления", exc_info=context.error)
+    uow = current_uow()
+    if uow is not None and context.coroutine is None and context.job is None:
+        uow.fail()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обновления разных чатов обрабатываются параллельно, обновления одного чата — строго по очереди.
+
+    Так ConversationHandler получает сообщения пользователя в том порядке, в котором они пришли.
+    max_in_flight ограничивает число одновременно выполняемых обработчиков, а общий лимит
+    принятых обновлений (выполняющиеся + ожидающие) — max_in_flight * QUEUE_FACTOR.
+    Каждое обновление обрабатывается в своей сессии базы (database.unit_of_work).
+    На нажатия кнопок бот отвечает не позже CALLBACK_ACK_DEADLINE после начала обработки (callback_ack),
+    а повторные нажатия той же кнопки тем же пользователем, пока первое в обработке, отбрасываются.
+    """
+
+    def __init__(self, max_in_flight):
+        super().__init__(max_in_flight * QUEUE_FACTOR)
+        self.max_in_flight = max_in_flight
+        self._running = asyncio.Semaphore(max_in_flight)
+        self._chat_locks = {}  # ключ чата -> [asyncio.Lock, число обновлений чата в обработке и очереди]
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.processed = 0
+        self.queries = 0
+        self.commits = 0
+        self.duplicate_taps = 0
+        self._taps = set()  # (пользователь, callback_data) нажатий в обработке и очереди
+
+    @staticmethod
+    def chat_key(update):
+        """Ключ очереди: чат, а для обновлений без чата — пользователь."""
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return "user", update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        query = update.callback_query if isinstance(update, Update) else None
+        if query is None:
+            await self._process(update, coroutine)
+            return
+
+        # Повторное нажатие той же кнопки, пока первое ещё обрабатывается, ничего нового не сделает
+        tap = (query.from_user.id, query.data)
+        if tap in self._taps:
+            coroutine.close()
+            self.duplicate_taps += 1
+            await callback_ack.answer_duplicate(query)
+            return
+
+        self._taps.add(tap)
+        callback_ack.start(query)
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self._taps.discard(tap)
+            await callback_ack.finish(query)
+
+    async def _process(self, update, coroutine):
+        key = self.chat_key(update)
+        if key is None:
+            async with self._running:
+                await self._run(update, coroutine)
+            return
+
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        waiting = True
+        try:
+            async with entry[0]:
+                async with self._running:
+                    self.queued -= 1
+                    waiting = False
+                    await self._run(update, coroutine)
+        finally:
+            if waiting:
+                self.queued -= 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+
+    async def _run(self, update, coroutine):
+        if isinstance(update, Update) and update.callback_query is not None:
+            callback_ack.begin(update.callback_query)
+        self.in_flight += 1
+        uow = None
+        started = time.perf_counter()
+        log_token = log_setup.bind_update(update)
+        profile = profiler.start() if profiler.ENABLED else None
+        try:
+            async with unit_of_work() as uow:
+                await coroutine
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+            if uow is not None:
+                self.queries += uow.queries
+                self.commits += uow.commits
+            elapsed = time.perf_counter() - started
+            if metrics.ENABLED:
+                metrics.observe_update(update, elapsed, uow)
+            if profile is not None:
+                profiler.finish(profile, update, elapsed, uow)
+            logger.debug("Обновление обработано", extra={"duration": round(elapsed, 4)})
+            log_setup.unbind_update(log_token)
+
+    def stats(self):
+        """Снимок метрик очереди для логов и мониторинга."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "active_chats": len(self._chat_locks),
+            "processed": self.processed,
+            "queries": self.queries,
+            "commits": self.commits,
+            "duplicate_taps": self.duplicate_taps,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,10 +1,12 @@
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
+import callbacks
+
 def main_menu_keyboard():
     keyboard = [
-        [InlineKeyboardButton("Создать событие", callback_data='create_event')],
-        [InlineKeyboardButton("Список событий", callback_data='list_events')],
-        [InlineKeyboardButton("Мои события", callback_data='my_events')],
-        [InlineKeyboardButton("Мой календарь", callback_data='my_calendar')],
+        [InlineKeyboardButton("Создать событие", callback_data=callbacks.encode(callbacks.CREATE_EVENT))],
+        [InlineKeyboardButton("Список событий", callback_data=callbacks.encode(callbacks.LIST_EVENTS))],
+        [InlineKeyboardButton("Мои события", callback_data=callbacks.encode(callbacks.MY_EVENTS))],
+        [InlineKeyboardButton("Мой календарь", callback_data=callbacks.encode(callbacks.MY_CALENDAR))],
     ]
     return InlineKeyboardMarkup(keyboard)